@@ -0,0 +1,187 @@
+""" Headless batch generation of posts and images from a CSV or JSONL file of prompts.
+
+Each input row needs a "prompt" and may have an "id", an "image_path" to an existing
+photo, and "sizes" (comma separated, e.g. "1024x1024,1024x1792").  Results are streamed
+to the output JSONL file one line per row as they finish, and rows already in the
+output file are skipped, so an interrupted run can simply be restarted.
+
+Example:
+    python batch_generate.py prompts.csv --output posts.jsonl --images-dir batch_images
+"""
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from utils.image_utils import generate_dalle3_images, get_png_bytes
+from utils.post_utils import create_post, stream_post, alter_image
+from utils.heic_utils import is_heic, prepare_heic_image
+from utils.upload_utils import prepare_vision_image
+
+logger = logging.getLogger("batch_generate")
+
+DEFAULT_SIZES = ["1024x1024"]
+
+class RequestPacer:
+    """ Spaces out the start of each row so the batch stays under a requests per minute budget. """
+    def __init__(self, rows_per_minute: float):
+        self.interval = 60 / rows_per_minute if rows_per_minute else 0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """ Wait until the next row is allowed to start. """
+        async with self._lock:
+            delay = self._next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_start = max(self._next_start, time.monotonic()) + self.interval
+
+def read_rows(input_path: str) -> list:
+    """ Read the input rows from a CSV or JSONL file, giving each row an id. """
+    with open(input_path, newline="", encoding="utf-8") as input_file:
+        if input_path.endswith(".csv"):
+            rows = list(csv.DictReader(input_file))
+        else:
+            rows = [json.loads(line) for line in input_file if line.strip()]
+    for index, row in enumerate(rows):
+        row["id"] = str(row.get("id") or index)
+    return rows
+
+def read_completed_ids(output_path: str) -> set:
+    """ Get the ids of the rows that already completed successfully in the output file. """
+    completed_ids = set()
+    if not os.path.exists(output_path):
+        return completed_ids
+    with open(output_path, encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                completed_ids.add(str(record["id"]))
+    return completed_ids
+
+def get_sizes(row: dict) -> list:
+    sizes = row.get("sizes") or DEFAULT_SIZES
+    if isinstance(sizes, str):
+        sizes = [size.strip() for size in sizes.split(",") if size.strip()]
+    return sizes
+
+def write_image(image_bytes: bytes, image_path: str):
+    with open(image_path, "wb") as image_file:
+        image_file.write(image_bytes)
+
+async def generate_images(row: dict, image_prompt: str, images_dir: str) -> dict:
+    """ Generate every size for the row at once and write each image as it finishes.
+    Returns the image paths keyed by size. """
+    image_paths = {}
+    sizes = get_sizes(row)
+    generated_images = generate_dalle3_images(prompt=image_prompt, size_choices=sizes)
+    try:
+        async for index, generated_image in generated_images:
+            if isinstance(generated_image, dict):
+                raise RuntimeError(generated_image["error"])
+            image_path = os.path.join(images_dir, f"{row['id']}_{sizes[index]}.png")
+            await asyncio.to_thread(write_image, get_png_bytes(generated_image), image_path)
+            image_paths[sizes[index]] = image_path
+    finally:
+        # Cancels the sizes still generating when one fails, instead of when the generator is collected
+        await generated_images.aclose()
+    return image_paths
+
+async def generate_row(row: dict, images_dir: str) -> dict:
+    """ Generate the post, hashtags, image prompt and images for one input row. """
+    record = {"id": row["id"], "prompt": row["prompt"]}
+    image_task = None
+    if row.get("image_path"):
+        # With a photo, the post text and the vision image prompt are independent
+        if is_heic(row["image_path"]):
+            image_bytes = await prepare_heic_image(row["image_path"])
+        else:
+            image_bytes = await asyncio.to_thread(prepare_vision_image, row["image_path"])
+        post_response, image_prompt = await asyncio.gather(
+            create_post("no_image", row["prompt"]), alter_image(row["prompt"], image_bytes)
+        )
+        if not isinstance(post_response, dict):
+            raise RuntimeError(post_response)
+        if not image_prompt:
+            raise RuntimeError("No image prompt was generated")
+        record.update(post=post_response["post"], hashtags=post_response["hashtags"])
+        record["image_prompt"] = image_prompt
+        image_task = asyncio.create_task(generate_images(row, image_prompt, images_dir))
+    else:
+        # Without a photo the image prompt is part of the post response, so start
+        # generating as soon as that field arrives while the rest keeps streaming
+        try:
+            async for field, value in stream_post("with_image", row["prompt"]):
+                record[field] = value
+                if field == "image_prompt" and value and image_task is None:
+                    image_task = asyncio.create_task(generate_images(row, value, images_dir))
+        except BaseException:
+            if image_task:
+                image_task.cancel()
+            raise
+        if image_task is None:
+            raise RuntimeError("No image prompt was generated")
+    record["images"] = await image_task
+    return record
+
+async def run_batch(
+    rows: list, output_path: str, images_dir: str, concurrency: int, rows_per_minute: float
+):
+    """ Process the rows with bounded concurrency, appending each result to the output file. """
+    os.makedirs(images_dir, exist_ok=True)
+    completed_ids = read_completed_ids(output_path)
+    pending_rows = [row for row in rows if row["id"] not in completed_ids]
+    logger.info(f"{len(completed_ids)} rows already done, {len(pending_rows)} to go")
+    semaphore = asyncio.Semaphore(concurrency)
+    pacer = RequestPacer(rows_per_minute)
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        async def process(row: dict):
+            async with semaphore:
+                await pacer.wait()
+                started = time.monotonic()
+                try:
+                    record = await generate_row(row, images_dir)
+                    record["status"] = "ok"
+                except Exception as e:
+                    logger.error(f"Row {row['id']} failed: {e}")
+                    record = {"id": row["id"], "prompt": row.get("prompt"), "status": "error", "error": str(e)}
+                record["seconds"] = round(time.monotonic() - started, 2)
+                output_file.write(json.dumps(record) + "\n")
+                output_file.flush()
+                logger.info(f"Row {row['id']}: {record['status']} in {record['seconds']}s")
+                return record["status"] == "ok"
+
+        results = await asyncio.gather(*(process(row) for row in pending_rows))
+    return sum(results), len(results) - sum(results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Instagram posts and images in bulk.")
+    parser.add_argument("input", help="CSV or JSONL file with a prompt (and optional id, image_path, sizes) per row")
+    parser.add_argument("--output", default="batch_output.jsonl", help="JSONL file to stream results to")
+    parser.add_argument("--images-dir", default="batch_images", help="Directory to write generated images to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum rows processed at once")
+    parser.add_argument(
+        "--rows-per-minute", type=float, default=20,
+        help="Maximum rows started per minute (0 for no pacing)"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(args.log_level)
+
+    rows = read_rows(args.input)
+    succeeded, failed = asyncio.run(
+        run_batch(rows, args.output, args.images_dir, args.concurrency, args.rows_per_minute)
+    )
+    logger.info(f"Finished: {succeeded} succeeded, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+""" Load test of dalle3_main.py with simulated concurrent users, against the mock OpenAI server.
+
+Each simulated user is a Streamlit AppTest session walking post_verify -> post_home ->
+display_post (with a generated image) and then rerunning the finished post once.  All users
+run in this one process, like the sessions of a single Streamlit replica, so they share its
+CPU, GIL and memory.  For every concurrency level the tool reports the script execution time
+of each rerun, the growth of the process RSS, of each session's state and of the artifact
+store (where the sessions' image bytes live), and it names the first level where the rerun
+latency degrades past --degradation-factor times the single-user baseline.
+
+Example:
+    python -m benchmarks.load_test --concurrency 1,2,4,8,16 --image-latency 2
+
+The mock server runs in its own process (unless --base-url points at one already running)
+so its work is not counted against the app.
+"""
+import os
+import sys
+import time
+import uuid
+import socket
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from streamlit.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from utils.metrics import get_percentile
+from benchmarks.mock_openai_server import MockServerConfig, add_config_arguments, get_config
+from benchmarks.run_benchmarks import configure_environment
+
+logger = logging.getLogger("load_test")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dalle3_main.py")
+STEPS = ["post_verify", "post_home", "display_post", "rerun_post"]
+STEP_LABELS = {"post_verify": "verify", "post_home": "home", "display_post": "post", "rerun_post": "rerun"}
+
+# One bytecode cache for every session, like the real server (compiling the script on
+# several threads at once trips a CPython bug)
+_script_cache = ScriptCache()
+
+class LoadTestScriptRunner(LocalScriptRunner):
+    """ AppTest's script runner with the server's shared script cache and, like real
+    sessions, a session id of its own (AppTest gives every session the same one). """
+    def __init__(self, script_path: str, session_state):
+        super().__init__(script_path, session_state)
+        self._script_cache = _script_cache
+        self._session_id = str(uuid.uuid4())
+
+def use_shared_runtime():
+    """ Make AppTest sessions behave like concurrent sessions of one server.  AppTest installs
+    a stand-in Runtime for the length of each run and removes it when the run ends, which
+    breaks runs that overlap, so every session gets one shared stand-in instead. """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    app_test.LocalScriptRunner = LoadTestScriptRunner
+
+def get_rss_mb() -> float:
+    """ The current resident set size of this process. """
+    with open("/proc/self/statm") as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def get_value_size(value) -> int:
+    """ Approximate bytes held by a session state value (the payloads, not object overhead). """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (list, tuple, set)):
+        return sum(get_value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_value_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+def get_store_mb() -> float:
+    """ Bytes the artifact store holds in memory for every session so far. """
+    from utils.artifact_store import artifact_store
+    return artifact_store.total_bytes / (1024 * 1024)
+
+def get_session_state_size(app: AppTest) -> int:
+    state = app.session_state
+    return sum(get_value_size(state[key]) for key in state.filtered_state)
+
+def find_button(app: AppTest, label: str):
+    return next(button for button in app.button if button.label == label)
+
+def run_user(user_index: int, password: str, timeout: float) -> dict:
+    """ Walk one user through the app.  Returns the duration of each step, the session state
+    size after it, and any errors. """
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    durations = {}
+    errors = []
+
+    def run_step(step: str, action):
+        started = time.perf_counter()
+        action().run()
+        durations[step] = time.perf_counter() - started
+        if app.exception:
+            errors.append(f"{step}: {app.exception[0].value}")
+
+    try:
+        run_step("post_verify", lambda: app)
+        app.text_input[0].input(password)
+        run_step("post_home", lambda: find_button(app, "Submit").click())
+        app.selectbox[0].select("Let Us Generate One For You")
+        app.text_area[0].input(f"grilled peach salad with burrata (user {user_index})")
+        app.checkbox[0].check()
+        run_step("display_post", lambda: find_button(app, "Generate Post").click())
+        if not app.session_state["current_post"] or not app.session_state["generated_images"]:
+            errors.append("display_post: no post or image was generated")
+        run_step("rerun_post", lambda: app)
+    except Exception as e:
+        logger.exception(f"User {user_index} failed")
+        errors.append(f"{e.__class__.__name__}: {e}")
+    return {"durations": durations, "state_bytes": get_session_state_size(app), "errors": errors}
+
+def run_level(concurrency: int, users: int, password: str, timeout: float) -> dict:
+    """ Run the users with `concurrency` walking the app at once. """
+    rss_before = get_rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load-user") as executor:
+        results = list(executor.map(lambda index: run_user(index, password, timeout), range(users)))
+    wall_time = time.perf_counter() - started
+    step_stats = {}
+    for step in STEPS:
+        durations = sorted(result["durations"][step] for result in results if step in result["durations"])
+        if durations:
+            step_stats[step] = {
+                "p50": get_percentile(durations, 0.5), "p95": get_percentile(durations, 0.95),
+                "max": durations[-1],
+            }
+    errors = [error for result in results for error in result["errors"]]
+    return {
+        "concurrency": concurrency, "users": users, "wall_time": wall_time,
+        "users_per_minute": users * 60 / wall_time, "steps": step_stats,
+        "rss_growth_mb": get_rss_mb() - rss_before, "rss_mb": get_rss_mb(),
+        "state_kb_per_session": sum(result["state_bytes"] for result in results) / len(results) / 1024,
+        "store_mb": get_store_mb(),
+        "errors": errors,
+    }
+
+def find_degradation(levels: list, step: str, factor: float):
+    """ The first concurrency level whose p95 for the step exceeds factor times the baseline. """
+    baseline = levels[0]["steps"].get(step, {}).get("p95")
+    if not baseline:
+        return None
+    for level in levels[1:]:
+        if level["steps"].get(step, {}).get("p95", 0) > baseline * factor:
+            return level["concurrency"]
+    return None
+
+def start_mock_process(config: MockServerConfig) -> tuple:
+    """ Start the mock server in a subprocess on a free port and wait until it accepts connections. """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, "-m", "benchmarks.mock_openai_server", "--port", str(port)]
+    for name, value in config.model_dump().items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The mock OpenAI server did not start")
+
+def print_level(level: dict):
+    step_columns = "".join(
+        f"{level['steps'].get(step, {}).get('p50', 0):>11.3f}{level['steps'].get(step, {}).get('p95', 0):>10.3f}"
+        for step in STEPS
+    )
+    print(
+        f"{level['concurrency']:>5}{level['users']:>6}{level['users_per_minute']:>10.1f}{step_columns}"
+        f"{level['rss_growth_mb']:>9.1f}{level['state_kb_per_session']:>14.1f}{level['store_mb']:>10.1f}"
+        f"{len(level['errors']):>7}"
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent users of dalle3_main.py.")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated numbers of concurrent users")
+    parser.add_argument("--users", type=int, help="Users per level (default: twice the concurrency)")
+    parser.add_argument("--password", default="cupcake1!", help="Password for the post_verify page")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout in seconds of each rerun")
+    parser.add_argument(
+        "--degradation-factor", type=float, default=1.5,
+        help="Latency degrades once a step's p95 exceeds this multiple of the single-user p95"
+    )
+    parser.add_argument("--base-url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--log-level", default="WARNING")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    mock_process = None
+    base_url = args.base_url
+    if not base_url:
+        mock_process, base_url = start_mock_process(get_config(args))
+    configure_environment(base_url)
+    use_shared_runtime()
+    # The app's modules log at DEBUG by default, which would swamp the results
+    logging.getLogger().setLevel(args.log_level)
+
+    step_header = "".join(f"{STEP_LABELS[step] + ' p50':>11}{'p95':>10}" for step in STEPS)
+    print(f"Load testing {APP_PATH} against {base_url}")
+    print(f"{'conc':>5}{'users':>6}{'users/min':>10}{step_header}{'RSS +MB':>9}{'state KB/sess':>14}{'store MB':>10}{'errors':>7}")
+    levels = []
+    try:
+        for concurrency in concurrency_levels:
+            level = run_level(concurrency, args.users or concurrency * 2, args.password, args.timeout)
+            print_level(level)
+            for error in level["errors"][:3]:
+                print(f"      {error}")
+            levels.append(level)
+    finally:
+        if mock_process:
+            mock_process.terminate()
+
+    print()
+    for step in ("display_post", "rerun_post"):
+        degraded_at = find_degradation(levels, step, args.degradation_factor)
+        if degraded_at:
+            print(f"{step} p95 degrades past {args.degradation_factor}x the single-user baseline at {degraded_at} users")
+        else:
+            print(f"{step} p95 stays within {args.degradation_factor}x the single-user baseline up to {levels[-1]['concurrency']} users")
+    return 1 if any(level["errors"] for level in levels) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
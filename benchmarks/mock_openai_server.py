@@ -0,0 +1,223 @@
+""" Local stand-in for the OpenAI API, for benchmarking without network access or spend.
+
+Mimics the endpoints the app uses with configurable latency and payload sizes:
+    POST /v1/chat/completions   plain, JSON mode and vision requests, streamed or not
+    POST /v1/images/generations b64_json PNGs of the requested size
+
+Run it on its own (so it does not share the benchmark's process) with:
+    python -m benchmarks.mock_openai_server --port 8765
+and point the app or the benchmarks at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import logging
+import argparse
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pydantic import BaseModel, Field
+from PIL import Image
+
+logger = logging.getLogger("mock_openai_server")
+
+class MockServerConfig(BaseModel):
+    """ Latency (in seconds) and payload settings of the mock server """
+    chat_latency: float = Field(0.5, description="Time before a chat response (or its first token).")
+    vision_latency: float = Field(1.5, description="Time before a vision response.")
+    token_interval: float = Field(0.02, description="Time between streamed tokens.")
+    image_latency: float = Field(3.0, description="Time to generate each image.")
+    jitter: float = Field(0.2, description="Random extra latency as a fraction of the latency.")
+    post_tokens: int = Field(200, description="Tokens in a generated post.")
+    prompt_tokens: int = Field(60, description="Tokens in a generated image prompt.")
+    image_scale: float = Field(1.0, description="Scale of the returned images relative to the requested size.")
+
+WORDS = (
+    "golden crispy savory fresh homemade smoky tender zesty rustic vibrant drizzle garnish "
+    "brunch dinner plated seasonal herbs citrus charred creamy flaky spicy sweet tangy"
+).split()
+
+def sleep_with_jitter(seconds: float, jitter: float):
+    if seconds > 0:
+        time.sleep(seconds * (1 + random.uniform(0, jitter)))
+
+def make_words(count: int) -> list:
+    return [random.choice(WORDS) + " " for _ in range(count)]
+
+@lru_cache(maxsize=16)
+def make_png_b64(width: int, height: int) -> str:
+    """ A noise PNG (which barely compresses, like a photo) of the given size, base64 encoded. """
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=1)
+    return base64.b64encode(buffered.getvalue()).decode("ascii")
+
+def is_vision_request(messages: list) -> bool:
+    return any(
+        isinstance(message["content"], list)
+        and any(part.get("type") == "image_url" for part in message["content"])
+        for message in messages
+    )
+
+def make_chat_content(body: dict, config: MockServerConfig) -> list:
+    """ The response content as a list of tokens. """
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        response = {
+            "post": "".join(make_words(config.post_tokens)).strip(),
+            "hashtags": ["#food", "#foodie", "#instafood"],
+            "image_prompt": "".join(make_words(config.prompt_tokens)).strip(),
+        }
+        text = json.dumps(response)
+        # Roughly four characters per token, like the real tokenizer
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+    # The image prompt requests are the ones with a small max_tokens
+    if body.get("max_tokens") and body["max_tokens"] <= 250:
+        return make_words(config.prompt_tokens)
+    return make_words(config.post_tokens)
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockServerConfig()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            self.handle_chat(body)
+        elif self.path.endswith("/images/generations"):
+            self.handle_images(body)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def handle_chat(self, body: dict):
+        config = self.config
+        latency = config.vision_latency if is_vision_request(body.get("messages", [])) else config.chat_latency
+        tokens = make_chat_content(body, config)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        sleep_with_jitter(latency, config.jitter)
+        if not body.get("stream"):
+            if config.token_interval:
+                time.sleep(config.token_interval * len(tokens))
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(tokens), "total_tokens": 100 + len(tokens)},
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_rate_limit_headers()
+        self.end_headers()
+
+        def send_chunk(delta: dict, finish_reason=None):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+        send_chunk({"role": "assistant", "content": ""})
+        for token in tokens:
+            send_chunk({"content": token})
+            if config.token_interval:
+                time.sleep(config.token_interval)
+        send_chunk({}, "stop")
+        self.write_chunk("data: [DONE]\n\n")
+        self.write_chunk("")
+
+    def handle_images(self, body: dict):
+        config = self.config
+        width, height = (int(side) for side in body.get("size", "1024x1024").split("x"))
+        width, height = max(1, int(width * config.image_scale)), max(1, int(height * config.image_scale))
+        count = body.get("n", 1)
+        # Images in one request are generated in parallel
+        sleep_with_jitter(config.image_latency, config.jitter)
+        self.send_json(200, {
+            "created": int(time.time()),
+            "data": [
+                {"b64_json": make_png_b64(width, height), "revised_prompt": body.get("prompt")}
+                for _ in range(count)
+            ],
+        })
+
+    def send_rate_limit_headers(self):
+        for kind, limit in (("requests", 100000), ("tokens", 100000000)):
+            self.send_header(f"x-ratelimit-limit-{kind}", str(limit))
+            self.send_header(f"x-ratelimit-remaining-{kind}", str(limit - 1))
+            self.send_header(f"x-ratelimit-reset-{kind}", "1ms")
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_rate_limit_headers()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many concurrent clients connect at once during a benchmark
+    request_queue_size = 256
+
+def create_mock_server(config: MockServerConfig, host: str = "127.0.0.1", port: int = 0) -> MockOpenAIServer:
+    """ Create the mock server with the given settings.  Port 0 picks a free port. """
+    handler = type("ConfiguredMockOpenAIHandler", (MockOpenAIHandler,), {"config": config})
+    return MockOpenAIServer((host, port), handler)
+
+def start_mock_server(config: MockServerConfig, host: str = "127.0.0.1", port: int = 0) -> MockOpenAIServer:
+    """ Start the mock server on a daemon thread. """
+    server = create_mock_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+def get_base_url(server: MockOpenAIServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """ Add a command line option for every MockServerConfig field. """
+    for name, field in MockServerConfig.model_fields.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=field.annotation, default=field.default,
+            help=f"{field.description} (default: {field.default})"
+        )
+
+def get_config(args: argparse.Namespace) -> MockServerConfig:
+    return MockServerConfig(**{name: getattr(args, name) for name in MockServerConfig.model_fields})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local mock of the OpenAI API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    server = create_mock_server(get_config(args), args.host, args.port)
+    logger.info(f"Mock OpenAI API listening on {get_base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+""" Offline benchmarks of the generation helpers against the mock OpenAI server.
+
+Drives create_post, alter_image, get_image_prompt, generate_dalle3_image and
+generate_dalle2_images at each concurrency level and reports throughput, latency
+percentiles and peak RSS, followed by the per-stage timings from utils.metrics.
+
+Examples:
+    python -m benchmarks.run_benchmarks --requests 40 --concurrency 1,8,32
+    python -m benchmarks.run_benchmarks --targets create_post --image-latency 0.5 --output results.json
+    python -m benchmarks.run_benchmarks --base-url http://127.0.0.1:8765/v1  # an already running mock
+
+Every request uses a unique prompt so the prompt and image caches do not turn the
+benchmark into a cache benchmark.  Peak RSS is the high-water mark of the whole process
+(including the mock server when it runs in process), so it can only grow between rows.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import resource
+from PIL import Image
+from utils.metrics import metrics, get_percentile
+from benchmarks.mock_openai_server import add_config_arguments, get_config, start_mock_server, get_base_url
+
+logger = logging.getLogger("run_benchmarks")
+
+TARGETS = ["create_post", "alter_image", "get_image_prompt", "generate_dalle3_image", "generate_dalle2_images"]
+QUANTILES = (0.5, 0.95, 0.99)
+
+def configure_environment(base_url: str):
+    """ Point the app's clients at the mock server.  Must run before the utils are imported,
+    since they read their settings at import time. """
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("IMAGE_CACHE_DISK_ENABLED", "false")
+    os.environ.setdefault("PROMPT_CACHE_DISK_ENABLED", "false")
+    # The mock has no rate limits worth waiting for
+    os.environ.setdefault("OPENAI_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("OPENAI_TOKENS_PER_MINUTE", "1000000000")
+
+def get_peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+def make_vision_image(side: int) -> bytes:
+    """ A JPEG the size of a prepared upload, for the vision requests. """
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
+
+def get_target_calls(vision_image: bytes, size: str) -> dict:
+    """ A function per target taking a unique prompt and returning whether it succeeded. """
+    from utils.post_utils import create_post, alter_image, get_image_prompt
+    from utils.image_utils import generate_dalle3_image, generate_dalle2_images
+
+    async def call_create_post(prompt):
+        result = await create_post("with_image", prompt)
+        return isinstance(result, dict)
+
+    async def call_alter_image(prompt):
+        return bool(await alter_image(prompt, vision_image))
+
+    async def call_get_image_prompt(prompt):
+        return bool(await get_image_prompt(prompt))
+
+    async def call_generate_dalle3_image(prompt):
+        return not isinstance(await generate_dalle3_image(prompt, size), dict)
+
+    async def call_generate_dalle2_images(prompt):
+        return not isinstance(await generate_dalle2_images(prompt), dict)
+
+    return {
+        "create_post": call_create_post,
+        "alter_image": call_alter_image,
+        "get_image_prompt": call_get_image_prompt,
+        "generate_dalle3_image": call_generate_dalle3_image,
+        "generate_dalle2_images": call_generate_dalle2_images,
+    }
+
+async def run_target(name: str, call, requests: int, concurrency: int) -> dict:
+    """ Make the requests with at most `concurrency` in flight and summarize them. """
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    errors = 0
+
+    async def timed_call(index: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await call(f"roasted salmon with lemon and dill ({run_id}-{index})")
+            except Exception as e:
+                logger.error(f"{name} request failed: {e}")
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed_call(index) for index in range(requests)))
+    wall_time = time.perf_counter() - started
+    return {
+        "target": name, "concurrency": concurrency, "requests": requests, "errors": errors,
+        "throughput": requests / wall_time, "wall_time": wall_time,
+        **{f"p{round(quantile * 100)}": get_percentile(sorted(latencies), quantile) for quantile in QUANTILES},
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+async def run_benchmarks(targets: list, requests: int, concurrency_levels: list, vision_side: int, size: str) -> list:
+    target_calls = get_target_calls(make_vision_image(vision_side), size)
+    results = []
+    for name in targets:
+        for concurrency in concurrency_levels:
+            result = await run_target(name, target_calls[name], requests, concurrency)
+            print_result(result)
+            results.append(result)
+    return results
+
+def print_header():
+    print(
+        f"{'target':<24}{'conc':>5}{'reqs':>6}{'errors':>7}{'req/s':>9}"
+        f"{'p50 (s)':>9}{'p95 (s)':>9}{'p99 (s)':>9}{'peak RSS (MB)':>15}"
+    )
+
+def print_result(result: dict):
+    print(
+        f"{result['target']:<24}{result['concurrency']:>5}{result['requests']:>6}{result['errors']:>7}"
+        f"{result['throughput']:>9.2f}{result['p50']:>9.3f}{result['p95']:>9.3f}{result['p99']:>9.3f}"
+        f"{result['peak_rss_mb']:>15.1f}"
+    )
+
+def print_stage_summary(summary: dict):
+    print()
+    print(f"{'stage':<24}{'count':>7}{'p50 (s)':>9}{'p95 (s)':>9}{'p99 (s)':>9}")
+    for stage, stats in summary.items():
+        print(f"{stage:<24}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation helpers against a mock OpenAI API.")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="Comma separated targets to run")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per target and concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+    parser.add_argument("--size", default="1024x1024", help="Image size for generate_dalle3_image")
+    parser.add_argument("--vision-side", type=int, default=768, help="Side in pixels of the alter_image upload")
+    parser.add_argument("--base-url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--log-level", default="WARNING")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown_targets = set(targets) - set(TARGETS)
+    if unknown_targets:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown_targets))}")
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    base_url = args.base_url
+    if not base_url:
+        base_url = get_base_url(start_mock_server(get_config(args)))
+    configure_environment(base_url)
+    # The utils log at DEBUG by default, which would swamp the results
+    logging.getLogger().setLevel(args.log_level)
+
+    print(f"Benchmarking against {base_url}")
+    print_header()
+    results = asyncio.run(
+        run_benchmarks(targets, args.requests, concurrency_levels, args.vision_side, args.size)
+    )
+    stage_summary = metrics.summary()
+    print_stage_summary(stage_summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"results": results, "stages": stage_summary}, output_file, indent=2)
+    return 1 if any(result["errors"] for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,23 @@
 """ Main Instalicious Page """
 import streamlit as st
 import asyncio
-import io
-from PIL import Image
-from pillow_heif import register_heif_opener
 import streamlit.components.v1 as components
 from streamlit_extras.stylable_container import stylable_container
 from streamlit_extras.switch_page_button import switch_page
 from openai import OpenAIError
 from dependencies import get_openai_client
-from utils.image_utils import generate_dalle2_images
+from utils.image_utils import generate_dalle2_images, get_png_bytes
+from utils.upload_cache import process_upload, get_user_image_bytes
+from utils.stream_utils import StreamRenderer
 from utils.post_utils import alter_image2, get_image_prompt2
+from utils.retry_utils import call_with_retries_sync
+from utils.artifact_store import get_session_id
+from utils.post_history import record_post_in_background
 import logging
-import base64
-
-register_heif_opener()
 
 # Create the OpenAI client
 client = get_openai_client()
 
-def heic_to_base64(heic_path):
-    # Read HEIC file
-    heif_file = Image.open(heic_path)
-
-    # Convert to RGB
-    img = heif_file.convert("RGB")
-
-    # Create an in-memory file object
-    buffer = io.BytesIO()
-
-    # Save the image to the in-memory file object
-    img.save(buffer, format="JPEG")
-
-    # Encode to Base64
-    img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-    return img_base64
-
 
 st.set_page_config(
     page_title="Instalicio.us",
@@ -61,12 +42,13 @@ logger = logging.getLogger(__name__)
 def init_session_variables():
     # Initialize session state variables
     session_vars = [
-        "image_model", "user_image_string", "generate_image", "post_prompt",
-        "current_post", "current_hashtags", "current_image_prompt", "post_page", "generated_images"
+        "image_model", "user_image", "user_image_file_id", "generate_image", "post_prompt",
+        "current_post", "current_hashtags", "current_image_prompt", "post_page", "generated_images",
+        "post_recorded"
     ]
     default_values = [
-        "dall-e-3", None, False, None, None, None, None, "post_verify",
-        []
+        "dall-e-3", None, None, False, None, None, None, None, "post_verify",
+        [], False
     ]
 
     for var, default_value in zip(session_vars, default_values):
@@ -75,8 +57,9 @@ def init_session_variables():
 
 def reset_session_variables():
     session_vars = [
-        "image_model", "is_user_image", "user_image_string", "generate_image", "post_prompt"
-        "current_post", "current_hashtags", "current_image_prompt", "generated_images"
+        "image_model", "is_user_image", "user_image", "user_image_file_id",
+        "generate_image", "post_prompt",
+        "current_post", "current_hashtags", "current_image_prompt", "generated_images", "post_recorded"
     ]
     for var in session_vars:
         if var in st.session_state:
@@ -86,27 +69,41 @@ def reset_session_variables():
 
 init_session_variables()
 
-# Function to encode the image
-async def encode_image(image_file):
-    return base64.b64encode(image_file.read()).decode('utf-8')
-
 def save_image(image, path="image.png"):
-    image.save(path)
+    with open(path, "wb") as image_file:
+        image_file.write(get_png_bytes(image))
 
 def display_image(image):
-    st.image(image, use_column_width=True)
+    image_bytes = get_png_bytes(image)
+    if image_bytes is None:
+        st.warning("This image has expired. Please generate a new post.")
+        return
+    st.image(image_bytes, use_column_width=True)
 
 # Step 4: Create Download Link
 def get_image_download_link(image, filename="downloaded_image.png"):
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
+    image_bytes = get_png_bytes(image)
+    if image_bytes is None:
+        return False
     return st.download_button(
         label="Download Image",
-        data=buffered.getvalue(),
+        data=image_bytes,
         file_name=filename,
         use_container_width=True
     )
 
+def record_post_history():
+    """ Save the finished post and its images to the post history, once per post """
+    generated_images = st.session_state.generated_images
+    images = [get_png_bytes(image) for image in generated_images] if isinstance(generated_images, list) else []
+    record_post_in_background(
+        prompt=st.session_state.post_prompt, post=st.session_state.current_post,
+        images=[image_bytes for image_bytes in images if image_bytes],
+        image_prompt=st.session_state.current_image_prompt, model="dall-e-2",
+        session_id=get_session_id()
+    )
+    st.session_state.post_recorded = True
+
 def post_verify():
     password_input = st.text_input("Enter the password to access this page", type="password")
     submit_password_button = st.button("Submit", type="primary", use_container_width=True)
@@ -167,29 +164,18 @@ async def post_home():
         if picture_mode == "Snap a pic":
             uploaded_image = st.camera_input("Snap a pic")
             if uploaded_image:
-                if uploaded_image.name.endswith(".heic") or uploaded_image.name.endswith(".HEIC"):
-                    image_string = heic_to_base64(uploaded_image)
-                    st.session_state.user_image_string = image_string
-                else:
-                    image_string = await encode_image(uploaded_image)
-                st.session_state.user_image_string = image_string
+                st.session_state.user_image = await process_upload(uploaded_image)
 
         elif picture_mode == "Upload an image":
             # Show a file upoloader that only accepts image files
             uploaded_image = st.file_uploader(
                 "Upload an image", type=["png", "jpg", "jpeg", "heic", "HEIC"]
             )
-            # Convert the image to a base64 string
+            # Convert the image to compact JPEG bytes, once per distinct upload
             if uploaded_image:
-                # If the file type is .heic or .HEIC, convert to a .png using PIL
-                if uploaded_image.name.endswith(".heic") or uploaded_image.name.endswith(".HEIC"):
-                    image_string = heic_to_base64(uploaded_image)
-                    st.session_state.user_image_string = image_string
-                else:
-                    image_string = await encode_image(uploaded_image)
-                st.session_state.user_image_string = image_string
+                st.session_state.user_image = await process_upload(uploaded_image)
         elif picture_mode == "Let Us Generate One For You":
-            st.session_state.user_image_string = None
+            st.session_state.user_image = None
         st.text("")
         post_prompt = st.text_area("""###### Tell Us About This Recipe or Meal""")
 
@@ -282,22 +268,23 @@ async def display_post():
     st.markdown("**Here's your post!**")
     st.text("")
     message_placeholder = st.empty()
-    full_response = ""
+    renderer = StreamRenderer(message_placeholder)
     if st.session_state.current_post is None:
         try:
-            completion = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=messages,
-                stream=True,
+            completion = call_with_retries_sync(
+                lambda: client.chat.completions.create(
+                    model="gpt-4-turbo-preview",
+                    messages=messages,
+                    stream=True,
+                ),
+                "gpt-4-turbo-preview"
             )
             for chunk in completion:
                 if chunk.choices[0].finish_reason == "stop":
                     logging.debug("Received 'stop' signal from response.")
                     break
-                full_response += chunk.choices[0].delta.content
-                message_placeholder.markdown(full_response + "▌")
-            message_placeholder.markdown(full_response)
-            st.session_state.current_post = full_response
+                renderer.write(chunk.choices[0].delta.content)
+            st.session_state.current_post = renderer.close()
         except OpenAIError as e:
             logger.error(f"Error generating post: {e}")
             st.error(f"Error generating post: {e}")
@@ -321,17 +308,20 @@ async def display_post():
         components.html(html, height=75)
         st.text("")
 
-    if not st.session_state.generated_images != [] and st.session_state.user_image_string:
+    user_image_bytes = get_user_image_bytes() if not st.session_state.generated_images != [] else None
+    if not st.session_state.generated_images != [] and user_image_bytes:
         with st.spinner("Hang tight, we are generating your images. This may take a minute..."):
             image_prompt = await alter_image2(
-                st.session_state.post_prompt, st.session_state.user_image_string
+                st.session_state.post_prompt, user_image_bytes
             )
+            st.session_state.current_image_prompt = image_prompt
             st.session_state.generated_images = await generate_dalle2_images(
                 prompt=image_prompt
             )
-    elif not st.session_state.generated_images != [] and st.session_state.user_image_string is None:
+    elif not st.session_state.generated_images != [] and user_image_bytes is None:
         with st.spinner("Hang tight, we are generating your images. This may take a minute..."):
             image_prompt = await get_image_prompt2(st.session_state.post_prompt)
+            st.session_state.current_image_prompt = image_prompt
             st.session_state.generated_images = await generate_dalle2_images(
                 prompt=image_prompt
             )
@@ -367,6 +357,8 @@ async def display_post():
                 get_image_download_link(
                     st.session_state.generated_images[2], filename="instalicious_image_3.png"
                 )
+    if st.session_state.current_post and not st.session_state.post_recorded:
+        record_post_history()
 
     generate_new_post_button = st.button("Generate New Post", type="primary", use_container_width=True)
     if generate_new_post_button:
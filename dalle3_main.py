@@ -1,18 +1,21 @@
 """ Main Instalicious Page """
 import streamlit as st
+import time
 import asyncio
-import io
-from PIL import Image
-from pillow_heif import register_heif_opener
 import streamlit.components.v1 as components
 from streamlit_extras.stylable_container import stylable_container
 from streamlit_extras.switch_page_button import switch_page
 from openai import OpenAIError
-from dependencies import get_openai_client
-from utils.image_utils import generate_dalle3_image
+from dependencies import get_async_openai_client
+from utils.image_utils import generate_dalle3_images, get_png_bytes
+from utils.upload_cache import process_upload, get_user_image_bytes
+from utils.stream_utils import StreamRenderer
 from utils.post_utils import alter_image, get_image_prompt
+from utils.rate_limiter import scheduler, scheduled_request, estimate_chat_tokens
+from utils.artifact_store import get_session_id
+from utils.metrics import span, record_duration
+from utils.post_history import record_post_in_background
 import logging
-import base64
 
 
 st.set_page_config(
@@ -20,29 +23,6 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-register_heif_opener()
-
-# Create the OpenAI client
-client = get_openai_client()
-
-def heic_to_base64(heic_path):
-    # Read HEIC file
-    heif_file = Image.open(heic_path)
-
-    # Convert to RGB
-    img = heif_file.convert("RGB")
-
-    # Create an in-memory file object
-    buffer = io.BytesIO()
-
-    # Save the image to the in-memory file object
-    img.save(buffer, format="JPEG")
-
-    # Encode to Base64
-    img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-    return img_base64
-
 # Import Google Font in Streamlit CSS
 st.markdown(
     """
@@ -61,13 +41,13 @@ logger = logging.getLogger(__name__)
 def init_session_variables():
     # Initialize session state variables
     session_vars = [
-        "image_model", "user_image_string", "generate_image", "post_prompt",
+        "image_model", "user_image", "user_image_file_id", "generate_image", "post_prompt",
         "current_post", "current_hashtags", "current_image_prompt", "post_page",
-        "generated_images", "size_choices"
+        "generated_images", "size_choices", "post_recorded"
     ]
     default_values = [
-        "dall-e-3", None, False, None, None, None, None, "post_verify",
-        [], []
+        "dall-e-3", None, None, False, None, None, None, None, "post_verify",
+        [], [], False
     ]
 
     for var, default_value in zip(session_vars, default_values):
@@ -76,8 +56,10 @@ def init_session_variables():
 
 def reset_session_variables():
     session_vars = [
-        "image_model", "is_user_image", "user_image_string", "generate_image", "post_prompt"
-        "current_post", "current_hashtags", "current_image_prompt", "generated_images", "size_choices"
+        "image_model", "is_user_image", "user_image", "user_image_file_id",
+        "generate_image", "post_prompt",
+        "current_post", "current_hashtags", "current_image_prompt", "generated_images", "size_choices",
+        "post_recorded"
     ]
     for var in session_vars:
         if var in st.session_state:
@@ -87,26 +69,168 @@ def reset_session_variables():
 
 init_session_variables()
 
-# Function to encode the image
-async def encode_image(image_file):
-    return base64.b64encode(image_file.read()).decode('utf-8')
-
 def save_image(image, path="image.png"):
-    image.save(path)
+    with open(path, "wb") as image_file:
+        image_file.write(get_png_bytes(image))
 
 def display_image(image):
-    st.image(image, use_column_width=True)
+    image_bytes = get_png_bytes(image)
+    if image_bytes is None:
+        st.warning("This image has expired. Please generate a new post.")
+        return
+    st.image(image_bytes, use_column_width=True)
 
 # Step 4: Create Download Link
 def get_image_download_link(image, filename="downloaded_image.png"):
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return st.download_button(
-        label="Download Image",
-        data=buffered.getvalue(),
-        file_name=filename,
-        use_container_width=True
+    with span("download_encode"):
+        image_bytes = get_png_bytes(image)
+        if image_bytes is None:
+            return False
+        return st.download_button(
+            label="Download Image",
+            data=image_bytes,
+            file_name=filename,
+            use_container_width=True
+        )
+
+def get_image_filename(index, image_count):
+    """ Get the download file name for the image at the given index """
+    return f"image{index + 1}.png" if image_count > 1 else "image.png"
+
+def get_image_slots(image_count):
+    """ Create one slot per image, using 2 columns when there is more than one image """
+    if image_count > 1:
+        return [column.empty() for column in st.columns(image_count, gap="medium")]
+    return [st.empty()]
+
+def display_generated_image(image_slot, generated_image, filename):
+    """ Display a generated image and its download link in the given slot """
+    with image_slot.container():
+        if isinstance(generated_image, dict) and "error" in generated_image:
+            st.error(f"Error generating image: {generated_image['error']}")
+            return
+        display_image(generated_image)
+        get_image_download_link(generated_image, filename)
+
+async def generate_images(image_slots):
+    """ Generate the image prompt, then generate every chosen size at once,
+    displaying each image as soon as it is ready.  Finished images are saved to the session
+    state as they arrive, so a rerun (such as a download click) only generates the rest. """
+    with st.spinner("Hang tight, we are generating your image(s).  This may take a minute."):
+        image_prompt = st.session_state.current_image_prompt
+        if not image_prompt:
+            user_image_bytes = get_user_image_bytes()
+            if user_image_bytes:
+                image_prompt = await alter_image(st.session_state.post_prompt, user_image_bytes)
+            else:
+                image_prompt = await get_image_prompt(st.session_state.post_prompt)
+            st.session_state.current_image_prompt = image_prompt
+        if not image_prompt:
+            # Without a prompt there is nothing to generate; show the error in every slot
+            generated_images = [
+                {"error": "We couldn't create an image prompt. Please try again."}
+                for _ in st.session_state.size_choices
+            ]
+            for index, generated_image in enumerate(generated_images):
+                display_generated_image(
+                    image_slots[index], generated_image, get_image_filename(index, len(image_slots))
+                )
+            st.session_state.generated_images = generated_images
+            return
+        generated_images = st.session_state.generated_images
+        if len(generated_images) != len(st.session_state.size_choices):
+            generated_images = [None] * len(st.session_state.size_choices)
+            st.session_state.generated_images = generated_images
+        missing_indexes = []
+        for index, generated_image in enumerate(generated_images):
+            if generated_image is None:
+                missing_indexes.append(index)
+            else:
+                display_generated_image(
+                    image_slots[index], generated_image, get_image_filename(index, len(image_slots))
+                )
+        async for missing_index, generated_image in generate_dalle3_images(
+            prompt=image_prompt,
+            size_choices=[st.session_state.size_choices[index] for index in missing_indexes]
+        ):
+            index = missing_indexes[missing_index]
+            generated_images[index] = generated_image
+            display_generated_image(
+                image_slots[index], generated_image, get_image_filename(index, len(image_slots))
+            )
+
+def images_pending() -> bool:
+    """ Whether any chosen size still has no image (or error) in the session state """
+    return not st.session_state.generated_images or None in st.session_state.generated_images
+
+def record_post_history():
+    """ Save the finished post and its images to the post history, once per post """
+    images = [
+        get_png_bytes(image) for image in st.session_state.generated_images
+        if not (isinstance(image, dict) and "error" in image)
+    ]
+    record_post_in_background(
+        prompt=st.session_state.post_prompt, post=st.session_state.current_post,
+        images=[image_bytes for image_bytes in images if image_bytes],
+        image_prompt=st.session_state.current_image_prompt, model=st.session_state.image_model,
+        session_id=get_session_id()
     )
+    st.session_state.post_recorded = True
+
+async def stream_post(messages, message_placeholder):
+    """ Stream the post text into the placeholder and save it to the session state """
+    renderer = StreamRenderer(message_placeholder)
+    client = get_async_openai_client()
+    started = time.perf_counter()
+    first_token = True
+    try:
+        completion = await scheduled_request(
+            client.chat.completions.with_raw_response.create,
+            estimate_chat_tokens(messages),
+            model="gpt-4-turbo-preview",
+            messages=messages,
+            stream=True,
+        )
+        async for chunk in completion:
+            if chunk.choices[0].finish_reason == "stop":
+                logging.debug("Received 'stop' signal from response.")
+                break
+            if first_token and chunk.choices[0].delta.content:
+                record_duration("post_first_token", time.perf_counter() - started, post_type="text")
+                first_token = False
+            renderer.write(chunk.choices[0].delta.content)
+        st.session_state.current_post = renderer.close()
+        record_duration("post_stream_total", time.perf_counter() - started, post_type="text")
+    except OpenAIError as e:
+        logger.error(f"Error generating post: {e}")
+        st.error(f"Error generating post: {e}")
+
+def display_queue_position(queue_placeholder, position):
+    """ Show the session's place in the shared request queue while it waits for rate limits """
+    if position:
+        queue_placeholder.caption(f"The kitchen is busy, you're #{position} in line...")
+    else:
+        queue_placeholder.empty()
+
+def display_copy_button(post):
+    """ Display a button that copies the post text to the clipboard """
+    html = f"""
+    <input type="text" id="textToCopy" value="{post}" style="color:transparent;
+    border-color:transparent;">
+    <button onclick="copyToClipboard()" style="background-color:transparent; height: 2.75em;
+    margin-left: 7em; border-radius:4px; font-size:1em;">Copy Post 📋</button>
+
+    <script>
+        function copyToClipboard() {{
+            var copyText = document.getElementById("textToCopy");
+            copyText.select();
+            copyText.setSelectionRange(0, 99999); /* For mobile devices */
+            document.execCommand("copy");
+            alert("Copied the text: " + copyText.value);
+        }}
+    </script>
+    """
+    components.html(html, height=75)
 
 def post_verify():
     password_input = st.text_input("Enter the password to access this page", type="password")
@@ -168,29 +292,18 @@ async def post_home():
         if picture_mode == "Snap a pic":
             uploaded_image = st.camera_input("Snap a pic")
             if uploaded_image:
-                if uploaded_image.name.endswith(".heic") or uploaded_image.name.endswith(".HEIC"):
-                    image_string = heic_to_base64(uploaded_image)
-                    st.session_state.user_image_string = image_string
-                else:
-                    image_string = await encode_image(uploaded_image)
-                st.session_state.user_image_string = image_string
+                st.session_state.user_image = await process_upload(uploaded_image)
 
         elif picture_mode == "Upload an image":
             # Show a file upoloader that only accepts image files
             uploaded_image = st.file_uploader(
                 "Upload an image", type=["png", "jpg", "jpeg", "heic", "HEIC"]
             )
-            # Convert the image to a base64 string
+            # Convert the image to compact JPEG bytes, once per distinct upload
             if uploaded_image:
-                # If the file type is .heic or .HEIC, convert to a .png using PIL
-                if uploaded_image.name.endswith(".heic") or uploaded_image.name.endswith(".HEIC"):
-                    image_string = heic_to_base64(uploaded_image)
-                    st.session_state.user_image_string = image_string
-                else:
-                    image_string = await encode_image(uploaded_image)
-                st.session_state.user_image_string = image_string
+                st.session_state.user_image = await process_upload(uploaded_image)
         elif picture_mode == "Let Us Generate One For You":
-            st.session_state.user_image_string = None
+            st.session_state.user_image = None
         st.text("")
         post_prompt = st.text_area("""###### Tell Us About This Recipe or Meal""")
         st.markdown("**Choose the image size(s) for your post:**")
@@ -292,97 +405,57 @@ async def display_post():
         ]
     st.markdown("**Here's your post!**")
     st.text("")
+    queue_placeholder = st.empty()
     message_placeholder = st.empty()
-    full_response = ""
-    if st.session_state.current_post is None:
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=messages,
-                stream=True,
-            )
-            for chunk in completion:
-                if chunk.choices[0].finish_reason == "stop":
-                    logging.debug("Received 'stop' signal from response.")
-                    break
-                full_response += chunk.choices[0].delta.content
-                message_placeholder.markdown(full_response + "▌")
-            message_placeholder.markdown(full_response)
-            st.session_state.current_post = full_response
-        except OpenAIError as e:
-            logger.error(f"Error generating post: {e}")
-            st.error(f"Error generating post: {e}")
-    if st.session_state.current_post:
-        html = f"""
-        <input type="text" id="textToCopy" value="{st.session_state.current_post}" style="color:transparent;
-        border-color:transparent;">
-        <button onclick="copyToClipboard()" style="background-color:transparent; height: 2.75em;
-        margin-left: 7em; border-radius:4px; font-size:1em;">Copy Post 📋</button>
-
-        <script>
-            function copyToClipboard() {{
-                var copyText = document.getElementById("textToCopy");
-                copyText.select();
-                copyText.setSelectionRange(0, 99999); /* For mobile devices */
-                document.execCommand("copy");
-                alert("Copied the text: " + copyText.value);
-            }}
-        </script>
-        """
-        components.html(html, height=75)
-        st.text("")
-    if not st.session_state.generated_images != [] and st.session_state.user_image_string:
-        with st.spinner("Hang tight, we are generating your image(s).  This may take a minute."):
-            image_prompt = await alter_image(st.session_state.post_prompt, st.session_state.user_image_string)
-            for size_choice in st.session_state.size_choices:
-                generated_image = await generate_dalle3_image(
-                    prompt=image_prompt, size_choice=size_choice
-                )
-                st.session_state.generated_images.append(generated_image)
-    elif not st.session_state.generated_images != [] and st.session_state.user_image_string is None:
-        with st.spinner("Hang tight, we are generating your image(s).  This may take a minute."):
-            image_prompt = await get_image_prompt(st.session_state.post_prompt)
-            for size_choice in st.session_state.size_choices:
-                generated_image = await generate_dalle3_image(
-                    prompt=image_prompt, size_choice=size_choice
+    copy_placeholder = st.empty()
+    image_task = None
+    session_id = get_session_id()
+    scheduler.set_queue_listener(
+        session_id, lambda position: display_queue_position(queue_placeholder, position)
+    )
+    try:
+        if st.session_state.generated_images != [] or st.session_state.size_choices:
+            with stylable_container(
+                key="image-display-container",
+                css_styles="""
+                    button {
+                        color: white;
+                        background-color: #76beaa;
+                    }
+                """,
+            ):
+                st.markdown(
+                    """<p style='text-align: center; color: #000000;
+                    font-size: 20px; font-family:"Arapey";'>Here are your image(s)!</p>""", unsafe_allow_html=True
                 )
-                st.session_state.generated_images.append(generated_image)
-    if st.session_state.generated_images != []:
-        with stylable_container(
-            key="image-display-container",
-            css_styles="""
-                button {
-                    color: white;
-                    background-color: #76beaa;
-                }
-            """,
-        ):
-            st.markdown(
-                """<p style='text-align: center; color: #000000;
-                font-size: 20px; font-family:"Arapey";'>Here are your image(s)!</p>""", unsafe_allow_html=True
-            )
-            # If the length of the generated images list is greater than 1,
-            # use 2 columns to display the images
-            if len(st.session_state.generated_images) > 1:
-                col1, col2 = st.columns(2, gap="medium")
-                with col1:
-                    st.image(
-                        st.session_state.generated_images[0], use_column_width=True
-                    )
-                    # Create the download link for the first image
-                    get_image_download_link(st.session_state.generated_images[0], "image1.png")
-                with col2:
-                    st.image(
-                        st.session_state.generated_images[1], use_column_width=True
-                    )
-                    # Create the download link for the first image
-                    get_image_download_link(st.session_state.generated_images[1], "image2.png")
-            else:
-                st.image(
-                    st.session_state.generated_images[0], use_column_width=True
+                image_slots = get_image_slots(
+                    len(st.session_state.generated_images) or len(st.session_state.size_choices)
                 )
-                # Create the download link for the first image
-                get_image_download_link(st.session_state.generated_images[0], "image.png")
+                if images_pending():
+                    # Start the image branch right away so it runs while the post text streams
+                    image_task = asyncio.create_task(generate_images(image_slots))
+                else:
+                    for index, generated_image in enumerate(st.session_state.generated_images):
+                        display_generated_image(
+                            image_slots[index], generated_image, get_image_filename(index, len(image_slots))
+                        )
+
+        if st.session_state.current_post is None:
+            await stream_post(messages, message_placeholder)
+        else:
+            message_placeholder.markdown(st.session_state.current_post)
+        if st.session_state.current_post:
+            with copy_placeholder.container():
+                display_copy_button(st.session_state.current_post)
+                st.text("")
+        if image_task:
+            await image_task
+    finally:
+        # Stop reporting queue positions to this run even if it fails or is stopped
+        scheduler.set_queue_listener(session_id, None)
+    queue_placeholder.empty()
+    if st.session_state.current_post and not st.session_state.post_recorded:
+        record_post_history()
 
     generate_new_post_button = st.button("Generate New Post", type="primary", use_container_width=True)
     if generate_new_post_button:
@@ -7,7 +7,7 @@ from pillow_heif import register_heif_opener
 from streamlit_extras.stylable_container import stylable_container
 import streamlit.components.v1 as components
 from streamlit_extras.switch_page_button import switch_page
-from utils.image_utils import generate_dalle3_image
+from utils.image_utils import generate_dalle3_image, get_png_bytes
 from utils.post_utils import create_post, alter_image
 import logging
 import base64
@@ -85,18 +85,17 @@ async def encode_image(image_file):
     return base64.b64encode(image_file.read()).decode('utf-8')
 
 def save_image(image, path="image.png"):
-    image.save(path)
+    with open(path, "wb") as image_file:
+        image_file.write(get_png_bytes(image))
 
 def display_image(image):
-    st.image(image, use_column_width=True)
+    st.image(get_png_bytes(image), use_column_width=True)
 
 # Step 4: Create Download Link
 def get_image_download_link(image, filename="downloaded_image.png"):
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
     return st.download_button(
         label="Download Image",
-        data=buffered.getvalue(),
+        data=get_png_bytes(image),
         file_name=filename,
         mime="image/png",
         use_container_width=True
@@ -1,12 +1,24 @@
 """ This file contains all the dependencies for the app. """
 import os
+import asyncio
+import threading
+import collections
+import importlib.util
+from functools import lru_cache
+import httpx
 # from google.oauth2 import service_account
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, AsyncStream
+from openai._legacy_response import LegacyAPIResponse
 
 # Load environment variables
 load_dotenv()
 
+# Connection pool settings shared by the sync and async clients
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
 
 def get_openai_api_key():
     """ Function to get the OpenAI API key. """
@@ -25,6 +37,191 @@ def get_openai_org():
 #    except Exception as e:
 #      print(e)
 
+def get_http_limits():
+    """ Get the connection pool limits for the OpenAI HTTP clients. """
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+def http2_supported():
+    """ HTTP/2 is only available when the optional h2 package is installed. """
+    return importlib.util.find_spec("h2") is not None
+
+@lru_cache(maxsize=None)
 def get_openai_client():
-    """ Get the OpenAI client. """
-    return OpenAI(api_key=get_openai_api_key(), organization=get_openai_org(), max_retries=3, timeout=30)
+    """ Get the process-wide OpenAI client.  The client and its connection pool are
+    built once and shared by every session, module and Streamlit rerun.  Retries are
+    handled by utils.retry_utils, so the client's own retries are turned off. """
+    return OpenAI(
+        api_key=get_openai_api_key(), organization=get_openai_org(), max_retries=0, timeout=30,
+        http_client=httpx.Client(limits=get_http_limits(), http2=http2_supported(), timeout=30)
+    )
+
+class ClientLoop:
+    """ A long-lived event loop on a daemon thread.  The process-wide AsyncOpenAI client and
+    its connection pool live on this loop, since an httpx pool can only be used from the loop
+    it first ran on, while Streamlit runs every rerun's asyncio.run() on a new loop. """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        # Only used from the client loop's thread
+        self._outbox = {}
+        self._flush_scheduled = False
+        threading.Thread(target=self.loop.run_forever, name="openai-client-loop", daemon=True).start()
+
+    async def run(self, coroutine):
+        """ Await the coroutine on the client loop from any other loop.  Cancelling the
+        caller (e.g. a hedged request that lost) cancels it on the client loop as well. """
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    def run_soon(self, coroutine):
+        """ Schedule the coroutine on the client loop without waiting for it. """
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call_on(self, caller_loop, callback):
+        """ Call the callback on the caller's loop, from the client loop.  The callbacks for a
+        loop made in one iteration of the client loop are sent with a single wakeup. """
+        self._outbox.setdefault(caller_loop, []).append(callback)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        outbox, self._outbox = self._outbox, {}
+        self._flush_scheduled = False
+        for caller_loop, callbacks in outbox.items():
+            try:
+                caller_loop.call_soon_threadsafe(run_callbacks, callbacks)
+            except RuntimeError:
+                # The caller's loop has closed (its rerun ended), so nothing is waiting
+                pass
+
+def run_callbacks(callbacks: list):
+    for callback in callbacks:
+        callback()
+
+class AsyncClientProxy:
+    """ Stands in for the AsyncOpenAI client (or any of its resources) on the caller's loop.
+    Calls are sent to the client loop, and the raw responses and streams they return are
+    wrapped so that reading them also happens there.  Each attribute is proxied once and then
+    kept on the proxy. """
+    def __init__(self, target, client_loop: ClientLoop):
+        self._target = target
+        self._client_loop = client_loop
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            proxy = self._wrap_method(value)
+        else:
+            proxy = AsyncClientProxy(value, self._client_loop)
+        # Found as a plain attribute from now on, so __getattr__ is not called again
+        setattr(self, name, proxy)
+        return proxy
+
+    def _wrap_method(self, method):
+        client_loop = self._client_loop
+
+        async def call(*args, **kwargs):
+            return wrap_client_result(await client_loop.run(method(*args, **kwargs)), client_loop)
+        return call
+
+class RawResponseProxy:
+    """ A with_raw_response result whose parsed stream is read on the client loop. """
+    def __init__(self, target: LegacyAPIResponse, client_loop: ClientLoop):
+        self._target = target
+        self._client_loop = client_loop
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def parse(self):
+        return wrap_client_result(self._target.parse(), self._client_loop)
+
+class AsyncStreamProxy:
+    """ An AsyncStream iterated from another loop.  The whole stream is read on the client
+    loop and its chunks are handed to the caller's loop in batches: the chunks parsed in one
+    iteration of the client loop, for every stream of the caller, cost a single trip across
+    threads.  The response is closed on the client loop when the stream ends, is
+    closed or the proxy is dropped, so a stream left before its end does not hold a pooled
+    connection. """
+    def __init__(self, target: AsyncStream, client_loop: ClientLoop):
+        self._target = target
+        self._client_loop = client_loop
+        self._batches = None
+        self._chunks = collections.deque()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._pump_future = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._pump_future is None:
+            self._batches = asyncio.Queue()
+            self._pump_future = asyncio.run_coroutine_threadsafe(
+                self._pump(asyncio.get_running_loop()), self._client_loop.loop
+            )
+        while not self._chunks:
+            self._chunks.extend(await self._batches.get())
+        chunk = self._chunks[0]
+        if isinstance(chunk, BaseException):
+            # The end of the stream (StopAsyncIteration) or its error; it stays for later calls
+            raise chunk
+        return self._chunks.popleft()
+
+    async def close(self):
+        if self._pump_future is not None:
+            self._pump_future.cancel()
+        await self._client_loop.run(self._target.close())
+
+    def __del__(self):
+        if self._pump_future is not None:
+            self._pump_future.cancel()
+        else:
+            self._client_loop.run_soon(self._target.close())
+
+    async def _pump(self, caller_loop):
+        """ Read the stream on the client loop, ending it with StopAsyncIteration or its error. """
+        try:
+            async for chunk in self._target:
+                self._send(caller_loop, chunk)
+            self._send(caller_loop, StopAsyncIteration())
+        except Exception as e:
+            self._send(caller_loop, e)
+        finally:
+            await self._target.close()
+
+    def _send(self, caller_loop, chunk):
+        with self._pending_lock:
+            self._pending.append(chunk)
+            if len(self._pending) > 1:
+                # The caller has not picked up the batch yet and will get this chunk with it
+                return
+        self._client_loop.call_on(caller_loop, self._deliver)
+
+    def _deliver(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        self._batches.put_nowait(batch)
+
+def wrap_client_result(result, client_loop: ClientLoop):
+    if isinstance(result, LegacyAPIResponse):
+        return RawResponseProxy(result, client_loop)
+    if isinstance(result, AsyncStream):
+        return AsyncStreamProxy(result, client_loop)
+    return result
+
+@lru_cache(maxsize=None)
+def get_async_openai_client():
+    """ Get the process-wide async OpenAI client.  Like the sync client, the client and its
+    connection pool are built once and shared by every session and rerun; requests made from
+    any event loop run on the client's own loop (see ClientLoop). """
+    client_loop = ClientLoop()
+    client = AsyncOpenAI(
+        api_key=get_openai_api_key(), organization=get_openai_org(), max_retries=0, timeout=30,
+        http_client=httpx.AsyncClient(limits=get_http_limits(), http2=http2_supported(), timeout=30)
+    )
+    return AsyncClientProxy(client, client_loop)
@@ -2,6 +2,7 @@
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 from streamlit_extras.stylable_container import stylable_container
+from utils.asset_utils import get_thumbnail
 
 st.set_page_config(
     page_title="DALL-E 2 Examples", page_icon=":camera_flash:",
@@ -109,7 +110,7 @@ def main():
             with col1:
                 st.markdown("##### Original Image:")
                 if original_images_list[int(selected_prompt[-1]) - 1]:
-                    st.image(original_images_list[int(selected_prompt[-1]) - 1], width=300)
+                    st.image(get_thumbnail(original_images_list[int(selected_prompt[-1]) - 1]), width=300)
                 else:
                     st.markdown(
                         ":red[**No image was provided.  These are generated solely from the prompt!**]"
@@ -118,7 +119,7 @@ def main():
             with col2:
                 st.markdown("##### Generated Images:")
                 for image in new_images_list[int(selected_prompt[-1]) - 1]:
-                    st.image(image, width=300)
+                    st.image(get_thumbnail(image), width=300)
                 # st.image(new_images_list[int(selected_prompt[-1]) - 1], width=300)
         st.text("")
         back_to_home = st.button("Back to Home", type="primary", use_container_width=True)
@@ -2,6 +2,7 @@
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 from streamlit_extras.stylable_container import stylable_container
+from utils.asset_utils import get_thumbnail
 
 st.set_page_config(
     page_title="DALL-E 3 Examples", page_icon=":camera_flash:",
@@ -120,14 +121,14 @@ def main():
             with col1:
                 st.markdown("##### Original Image:")
                 if original_images_list[int(selected_prompt[-1]) - 1]:
-                    st.image(original_images_list[int(selected_prompt[-1]) - 1], width=300)
+                    st.image(get_thumbnail(original_images_list[int(selected_prompt[-1]) - 1]), width=300)
                 else:
                     st.markdown(":red[**No image was provided.  We generated one!**]")
 
             with col2:
                 st.markdown("##### Generated Images (Stories, Square):")
                 for image in new_images_list[int(selected_prompt[-1]) - 1]:
-                    st.image(image, width=300)
+                    st.image(get_thumbnail(image), width=300)
         st.text("")
         back_to_home = st.button("Back to Home", type="primary", use_container_width=True)
         if back_to_home:
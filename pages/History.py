@@ -0,0 +1,88 @@
+""" Search and browse the posts generated so far, without calling the API """
+import datetime
+import streamlit as st
+from utils.post_history import post_history
+
+st.set_page_config(
+    page_title="Post History", page_icon=":books:",
+    initial_sidebar_state="collapsed"
+)
+
+PAGE_SIZE = 10
+
+def display_post_images(post, thumbnails=True):
+    """ Show the post's images side by side, as thumbnails or full size with download buttons """
+    if not post["images"]:
+        return
+    columns = st.columns(len(post["images"]), gap="medium")
+    for index, (column, image) in enumerate(zip(columns, post["images"])):
+        with column:
+            image_bytes = (
+                post_history.get_thumbnail_bytes(image["digest"]) if thumbnails
+                else post_history.get_image_bytes(image["digest"])
+            )
+            if image_bytes is None:
+                st.caption("This image is no longer available.")
+                continue
+            st.image(image_bytes, use_column_width=True)
+            if not thumbnails:
+                st.download_button(
+                    label="Download Image", data=image_bytes, file_name=f"post{post['id']}_image{index + 1}.png",
+                    key=f"download-{post['id']}-{index}", use_container_width=True
+                )
+
+def display_post_summary(post):
+    """ Show a search result with its thumbnails and a button to open it """
+    created_at = datetime.datetime.fromtimestamp(post["created_at"]).strftime("%b %d, %Y %H:%M")
+    st.markdown(f"**{post['prompt'][:120]}**")
+    st.caption(f"{created_at} · {post['model'] or ''} · {post['hashtags'][:120]}")
+    display_post_images(post)
+    if st.button("Open Post", key=f"open-{post['id']}", use_container_width=True):
+        st.session_state.history_post = post
+        st.rerun()
+    st.divider()
+
+def display_full_post(post):
+    """ Show the whole post with its full size images """
+    if st.button("Back to Results", use_container_width=True):
+        st.session_state.history_post = None
+        st.rerun()
+    st.markdown(f"**{post['prompt']}**")
+    st.markdown(post["post"])
+    if post["image_prompt"]:
+        with st.expander("Image prompt"):
+            st.write(post["image_prompt"])
+    display_post_images(post, thumbnails=False)
+
+def main():
+    if post_history is None:
+        st.info("The post history is disabled. Set POST_HISTORY_ENABLED=true to enable it.")
+        return
+    # Uses the password check of the main page
+    if st.session_state.get("post_page", "post_verify") == "post_verify":
+        st.info("Enter the password on the main page to see the post history.")
+        return
+    if st.session_state.get("history_post"):
+        display_full_post(st.session_state.history_post)
+        return
+
+    st.markdown("### Post History")
+    query = st.text_input("Search posts", placeholder="Search prompts, posts and hashtags, e.g. burrata #brunch")
+    if st.session_state.get("history_query") != query:
+        st.session_state.history_query = query
+        st.session_state.history_limit = PAGE_SIZE
+    limit = st.session_state.get("history_limit", PAGE_SIZE)
+    # Fetch one extra post to know whether there are more
+    posts = post_history.search(query, limit=limit + 1)
+    if not posts:
+        st.info("No posts found." if query else "No posts have been generated yet.")
+        return
+    for post in posts[:limit]:
+        display_post_summary(post)
+    if len(posts) > limit:
+        if st.button("Show More", type="primary", use_container_width=True):
+            st.session_state.history_limit = limit + PAGE_SIZE
+            st.rerun()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+""" Admin page with the latency percentiles of each generation stage """
+import os
+import streamlit as st
+from utils.metrics import metrics, METRICS_JSONL_PATH, METRICS_PROMETHEUS_PORT
+from utils.semantic_cache import get_hit_rates, semantic_cache
+
+st.set_page_config(
+    page_title="Metrics", page_icon=":stopwatch:",
+    initial_sidebar_state="collapsed"
+)
+
+# The page stays locked unless an admin password is configured
+METRICS_ADMIN_PASSWORD = os.getenv("METRICS_ADMIN_PASSWORD")
+
+def display_metrics():
+    """ Show p50/p95/p99 per stage for this server process """
+    st.markdown("### Stage latencies")
+    summary = metrics.summary()
+    if not summary:
+        st.info("No stages have been timed yet.")
+    else:
+        st.dataframe(
+            [
+                {
+                    "stage": stage, "count": stats["count"],
+                    "p50 (s)": round(stats["p50"], 3),
+                    "p95 (s)": round(stats["p95"], 3),
+                    "p99 (s)": round(stats["p99"], 3),
+                }
+                for stage, stats in summary.items()
+            ],
+            use_container_width=True, hide_index=True
+        )
+    st.caption(
+        f"Percentiles cover the most recent {metrics.window} timings of each stage in this process."
+    )
+    if METRICS_JSONL_PATH:
+        st.caption(f"Every timing is also appended to {METRICS_JSONL_PATH}.")
+    if METRICS_PROMETHEUS_PORT:
+        st.caption(f"Prometheus metrics are served on port {METRICS_PROMETHEUS_PORT} at /metrics.")
+    if semantic_cache is not None:
+        display_semantic_cache()
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Refresh", use_container_width=True):
+            st.rerun()
+    with col2:
+        if st.button("Reset", use_container_width=True):
+            metrics.reset()
+            st.rerun()
+
+def display_semantic_cache():
+    """ Show the near-duplicate prompt cache's hit rate per lookup """
+    st.markdown("### Semantic cache")
+    hit_rates = get_hit_rates()
+    if not hit_rates:
+        st.info("The semantic cache has not been used yet.")
+    else:
+        st.dataframe(
+            [
+                {
+                    "lookup": kind, "lookups": stats["lookups"], "hits": stats["hits"],
+                    "hit rate": f"{stats['hit_rate']:.1%}",
+                }
+                for kind, stats in hit_rates.items()
+            ],
+            use_container_width=True, hide_index=True
+        )
+    st.caption(f"Prompts count as the same at a cosine similarity of {semantic_cache.threshold} or more.")
+
+def main():
+    if not METRICS_ADMIN_PASSWORD:
+        st.info("Set METRICS_ADMIN_PASSWORD to enable this page.")
+        return
+    if not st.session_state.get("metrics_admin"):
+        password_input = st.text_input("Enter the admin password", type="password")
+        if st.button("Submit", type="primary", use_container_width=True):
+            if password_input == METRICS_ADMIN_PASSWORD:
+                st.session_state.metrics_admin = True
+                st.rerun()
+            else:
+                st.warning("Incorrect password. Please try again.")
+        return
+    display_metrics()
+
+if __name__ == "__main__":
+    main()
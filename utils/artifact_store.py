@@ -0,0 +1,225 @@
+""" Shared storage for the large binary artifacts of Streamlit sessions.
+
+Artifacts (generated images, prepared uploads, example thumbnails) are stored once per
+process, keyed by the sha256 digest of their content, however many sessions use them.
+Sessions keep only small ArtifactHandles in st.session_state; each handle holds a
+reference to its blob and releases it when it is garbage collected.
+
+The blobs in memory are bounded twice: by a budget for each session (counting the blobs
+the session references) and by a budget for the whole store.  Past either, the least
+recently used blobs leave memory, so the blobs of idle sessions go before those of active
+ones.  Blobs that are still referenced are spilled to a local disk tier (when enabled) and
+read back on demand; unreferenced blobs are simply dropped.
+"""
+import os
+import hashlib
+import logging
+import threading
+import weakref
+from typing import Optional
+from collections import OrderedDict
+from pydantic import BaseModel, Field
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.cache_utils import DiskCache
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SESSION_MEMORY_BUDGET_BYTES = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "32")) * 1024 * 1024
+ARTIFACT_STORE_MEMORY_BYTES = int(os.getenv("ARTIFACT_STORE_MEMORY_MB", "512")) * 1024 * 1024
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", os.path.join(".cache", "artifacts"))
+ARTIFACT_STORE_DISK_ENABLED = os.getenv("ARTIFACT_STORE_DISK_ENABLED", "true").lower() == "true"
+ARTIFACT_STORE_DISK_BYTES = int(os.getenv("ARTIFACT_STORE_DISK_MB", "2048")) * 1024 * 1024
+ARTIFACT_STORE_TTL_SECONDS = float(os.getenv("ARTIFACT_STORE_TTL_SECONDS", str(24 * 60 * 60)))
+
+def get_session_id() -> str:
+    """ Get the id of the current Streamlit session ("default" outside Streamlit). """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else "default"
+
+def get_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class ArtifactStore:
+    """ Thread-safe, reference-counted, content-addressed blob store with per-session and
+    total memory budgets.  References without a session (session_id None) are shared by
+    the whole process and do not count against any session's budget. """
+    def __init__(self, max_bytes: int, session_budget: int, disk_cache: DiskCache = None):
+        self.max_bytes = max_bytes
+        self.session_budget = session_budget
+        self.disk_cache = disk_cache
+        self.total_bytes = 0
+        # digest -> bytes for the blobs in memory, ordered from least to most recently used
+        self._blobs = OrderedDict()
+        # digest -> session id -> number of references
+        self._refs = {}
+        # session id -> digests the session references, least recently used first
+        self._sessions = {}
+        # session id -> bytes in memory of the blobs the session references
+        self._session_bytes = {}
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes, session_id: str = None) -> str:
+        """ Store the bytes (once per distinct content) and add a reference to them.
+        Returns the digest identifying the blob. """
+        digest = get_digest(data)
+        with self._lock:
+            self._add_ref(digest, session_id)
+            if digest not in self._blobs:
+                self._make_resident(digest, data)
+            self._touch(digest, session_id)
+            evicted = self._enforce_budgets(session_id)
+        self._spill(evicted)
+        return digest
+
+    def get(self, digest: str, session_id: str = None):
+        """ Return the bytes, reading them back from disk if they were evicted.
+        Returns None if they are gone altogether. """
+        with self._lock:
+            data = self._blobs.get(digest)
+            if data is not None:
+                self._touch(digest, session_id)
+                return data
+        if self.disk_cache is None:
+            return None
+        data = self.disk_cache.get(digest)
+        if data is None:
+            return None
+        with self._lock:
+            if digest not in self._blobs:
+                self._make_resident(digest, data)
+            self._touch(digest, session_id)
+            evicted = self._enforce_budgets(session_id)
+        self._spill(evicted)
+        return data
+
+    def release(self, digest: str, session_id: str = None):
+        """ Drop a reference to the blob.  Unreferenced blobs stay in memory until they are
+        evicted, so identical content stored again soon after is not copied twice. """
+        with self._lock:
+            holders = self._refs.get(digest)
+            if not holders or session_id not in holders:
+                return
+            holders[session_id] -= 1
+            if holders[session_id] == 0:
+                del holders[session_id]
+                if session_id is not None:
+                    self._remove_session_ref(digest, session_id)
+            unreferenced = not holders
+            if unreferenced:
+                del self._refs[digest]
+        if unreferenced and self.disk_cache is not None:
+            self.disk_cache.pop(digest)
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            return sum(self._refs.get(digest, {}).values())
+
+    def session_usage(self, session_id: str) -> int:
+        """ Bytes in memory of the blobs the session references. """
+        with self._lock:
+            return self._session_bytes.get(session_id, 0)
+
+    def _add_ref(self, digest: str, session_id: str):
+        holders = self._refs.setdefault(digest, {})
+        if session_id not in holders:
+            holders[session_id] = 0
+            if session_id is not None:
+                self._sessions.setdefault(session_id, OrderedDict())[digest] = None
+                self._session_bytes.setdefault(session_id, 0)
+                if digest in self._blobs:
+                    self._session_bytes[session_id] += len(self._blobs[digest])
+        holders[session_id] += 1
+
+    def _remove_session_ref(self, digest: str, session_id: str):
+        del self._sessions[session_id][digest]
+        if digest in self._blobs:
+            self._session_bytes[session_id] -= len(self._blobs[digest])
+        if not self._sessions[session_id]:
+            del self._sessions[session_id]
+            del self._session_bytes[session_id]
+
+    def _make_resident(self, digest: str, data: bytes):
+        self._blobs[digest] = data
+        self.total_bytes += len(data)
+        for holder in self._refs.get(digest, {}):
+            if holder is not None:
+                self._session_bytes[holder] += len(data)
+
+    def _touch(self, digest: str, session_id: str):
+        """ Mark the blob, and the session's use of it, as the most recently used. """
+        self._blobs.move_to_end(digest)
+        session_blobs = self._sessions.get(session_id)
+        if session_blobs is not None and digest in session_blobs:
+            session_blobs.move_to_end(digest)
+
+    def _enforce_budgets(self, session_id: str) -> list:
+        """ Evict blobs until both budgets are met.  Returns the evicted (digest, bytes, referenced). """
+        evicted = []
+        if session_id is not None:
+            while self._session_bytes.get(session_id, 0) > self.session_budget:
+                resident = [digest for digest in self._sessions[session_id] if digest in self._blobs]
+                # Keep the newest blob in memory even if it alone is over the budget
+                if len(resident) <= 1:
+                    break
+                evicted.append(self._evict(resident[0]))
+        while self.total_bytes > self.max_bytes and len(self._blobs) > 1:
+            evicted.append(self._evict(next(iter(self._blobs))))
+        return evicted
+
+    def _evict(self, digest: str) -> tuple:
+        """ Remove the blob from memory. """
+        data = self._blobs.pop(digest)
+        self.total_bytes -= len(data)
+        for holder in self._refs.get(digest, {}):
+            if holder is not None:
+                self._session_bytes[holder] -= len(data)
+        return digest, data, digest in self._refs
+
+    def _spill(self, evicted: list):
+        """ Write the evicted blobs that are still referenced to disk.  Runs outside the lock
+        so other sessions are not held up by the disk. """
+        for digest, data, referenced in evicted:
+            if not referenced:
+                continue
+            if self.disk_cache is not None:
+                self.disk_cache.set(digest, data)
+            else:
+                logger.debug(f"Dropped blob {digest} to stay within the memory budget")
+
+def get_artifact_disk_cache():
+    if not ARTIFACT_STORE_DISK_ENABLED:
+        return None
+    disk_cache = DiskCache(ARTIFACT_STORE_DIR, ARTIFACT_STORE_DISK_BYTES, ttl=ARTIFACT_STORE_TTL_SECONDS)
+    # Handles never outlive the process, so nothing can refer to the blobs a previous process spilled
+    disk_cache.clear()
+    return disk_cache
+
+# Shared by every session in the process
+artifact_store = ArtifactStore(
+    ARTIFACT_STORE_MEMORY_BYTES, SESSION_MEMORY_BUDGET_BYTES, disk_cache=get_artifact_disk_cache()
+)
+
+class ArtifactHandle(BaseModel):
+    """ Artifact Handle Model.  A small, session state friendly reference to a blob in the
+    artifact store; the reference is released when the handle is garbage collected. """
+    digest: str = Field(..., title="Digest", description="The sha256 digest of the blob's content.")
+    session_id: Optional[str] = Field(
+        None, title="Session Id", description="The session holding the reference, or None if shared."
+    )
+    nbytes: int = Field(..., title="Size In Bytes", description="The size of the blob.")
+
+    @classmethod
+    def from_bytes(cls, data: bytes, shared: bool = False, **fields):
+        """ Store the bytes and return a handle holding a reference to them.  The reference
+        belongs to the current session unless it is shared by the whole process. """
+        session_id = None if shared else get_session_id()
+        digest = artifact_store.put(data, session_id)
+        handle = cls(digest=digest, session_id=session_id, nbytes=len(data), **fields)
+        weakref.finalize(handle, artifact_store.release, digest, session_id)
+        return handle
+
+    @property
+    def data(self):
+        """ The bytes, or None if they have expired from the store. """
+        return artifact_store.get(self.digest, self.session_id)
@@ -0,0 +1,55 @@
+""" Helper utils for serving the static example assets """
+import io
+import os
+import logging
+import threading
+from PIL import Image
+from utils.artifact_store import ArtifactHandle
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The example pages display images at 300px wide; thumbnails are rendered at twice
+# that so they stay sharp on high-DPI screens
+THUMBNAIL_WIDTH = 300
+THUMBNAIL_SCALE = 2
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+# (image path, width) -> handle of the thumbnail in the artifact store
+_thumbnails = {}
+# Held while a thumbnail is built, so concurrent first hits build it only once
+_thumbnails_lock = threading.Lock()
+
+def get_thumbnail(image_path: str, width: int = THUMBNAIL_WIDTH):
+    """ Get a WebP thumbnail of the image sized for the given display width.
+    Thumbnails are built on first use and stored once, in the artifact store, for every
+    session; they are rebuilt if the store has since dropped them. """
+    thumbnail_bytes = get_stored_thumbnail(image_path, width)
+    if thumbnail_bytes is not None:
+        return thumbnail_bytes
+    if not os.path.exists(image_path):
+        logger.warning(f"Example image not found: {image_path}")
+        return image_path
+    with _thumbnails_lock:
+        # Another session may have built it while this one waited
+        thumbnail_bytes = get_stored_thumbnail(image_path, width)
+        if thumbnail_bytes is None:
+            thumbnail_bytes = build_thumbnail(image_path, width)
+            _thumbnails[(image_path, width)] = ArtifactHandle.from_bytes(thumbnail_bytes, shared=True)
+    return thumbnail_bytes
+
+def get_stored_thumbnail(image_path: str, width: int):
+    """ The thumbnail's bytes from the artifact store, or None if it was never built or has expired. """
+    handle = _thumbnails.get((image_path, width))
+    return handle.data if handle else None
+
+def build_thumbnail(image_file, width: int = THUMBNAIL_WIDTH) -> bytes:
+    """ Render the WebP thumbnail of the image, given its path or a file object. """
+    with Image.open(image_file) as image:
+        thumbnail_width = min(image.width, width * THUMBNAIL_SCALE)
+        thumbnail_height = round(image.height * thumbnail_width / image.width)
+        thumbnail = image.convert("RGB").resize((thumbnail_width, thumbnail_height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="WEBP", quality=THUMBNAIL_QUALITY, method=6)
+    logger.debug(f"Built thumbnail for {image_file}: {len(buffer.getvalue())} bytes")
+    return buffer.getvalue()
@@ -1,15 +1,14 @@
 """ Helper functions to use OpenAI Assistant API. """
-from dependencies import get_openai_client
-
-client = get_openai_client()
+from dependencies import get_async_openai_client
+from utils.retry_utils import call_with_retries
 
 assistant_id = "asst_AJBb9qwzFR12OyORfRRjAjH4"
 
 async def upload_file(image_file) -> str:
     """ Upload the file to OpenAI.  Returns the file id """
-    file_response = client.files.create(
-        file=open(f"{image_file}", "rb"),
-        purpose="assistants"
+    client = get_async_openai_client()
+    file_response = await call_with_retries(
+        lambda: client.files.create(file=open(f"{image_file}", "rb"), purpose="assistants"), "files"
     )
     return file_response.id
 
@@ -17,9 +16,10 @@ async def create_assistant_file_image(image_file):
     """ Return the enhanced image from the assitants API.
     Return True if successful, False otherwise. """
     file_id = await upload_file(image_file)
-    assistant_file = client.beta.assistants.files.create(
-        assistant_id=f"{assistant_id}",
-        file_id=f"{file_id}"
+    client = get_async_openai_client()
+    assistant_file = await call_with_retries(
+        lambda: client.beta.assistants.files.create(assistant_id=f"{assistant_id}", file_id=f"{file_id}"),
+        "assistants"
     )
     if assistant_file:
         return True
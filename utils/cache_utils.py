@@ -0,0 +1,184 @@
+""" Helper utils for the in-memory and on-disk caches """
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+def make_cache_key(*parts) -> str:
+    """ Build a content-addressed key (sha256 hex digest) from the given parts. """
+    payload = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+class LRUCache:
+    """ Thread-safe in-memory LRU cache bounded by the total size of its values,
+    with an optional time to live (in seconds) for each entry. """
+    def __init__(self, max_bytes: int, ttl: float = None, sizeof=len):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """ Return the cached value for the key, or None on a miss. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        """ Store the value, evicting the least recently used entries if needed. """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time())
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key: str):
+        """ Remove the key from the cache if it is present. """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """ Remove every entry from the cache. """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+class DiskCache:
+    """ Content-addressed on-disk cache of bytes values, bounded by the total size
+    of the files in the cache directory, with an optional time to live (in seconds). """
+    def __init__(self, directory: str, max_bytes: int, ttl: float = None, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        self.total_bytes = 0
+        # Maps key -> (size, stored_at), ordered from least to most recently used
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def get(self, key: str):
+        """ Return the cached bytes for the key, or None on a miss. """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                self._remove(key)
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                return cache_file.read()
+        except OSError as e:
+            logger.warning(f"Could not read cache entry {key}: {e}")
+            with self._lock:
+                if key in self._index:
+                    self._remove(key)
+            return None
+
+    def set(self, key: str, value: bytes):
+        """ Write the bytes to the cache, evicting the least recently used files if needed. """
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as cache_file:
+                cache_file.write(value)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            return
+        with self._lock:
+            if key in self._index:
+                self.total_bytes -= self._index.pop(key)[0]
+            self._index[key] = (len(value), time.time())
+            self.total_bytes += len(value)
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._index)))
+
+    def pop(self, key: str):
+        """ Remove the key from the cache if it is present. """
+        with self._lock:
+            if key in self._index:
+                self._remove(key)
+
+    def clear(self):
+        """ Remove every file from the cache. """
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _remove(self, key: str):
+        size, _ = self._index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """ Rebuild the index from the files already in the cache directory. """
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(self.suffix):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entries.append((stat.st_mtime, file_name[:-len(self.suffix)], stat.st_size))
+        for stored_at, key, size in sorted(entries):
+            self._index[key] = (size, stored_at)
+            self.total_bytes += size
+
+class TieredCache:
+    """ An in-memory LRU cache in front of an optional on-disk cache. """
+    def __init__(self, memory_cache: LRUCache, disk_cache: DiskCache = None):
+        self.memory_cache = memory_cache
+        self.disk_cache = disk_cache
+
+    def get(self, key: str):
+        """ Return the cached bytes for the key, checking memory first and then disk. """
+        value = self.memory_cache.get(key)
+        if value is None and self.disk_cache is not None:
+            value = self.disk_cache.get(key)
+            if value is not None:
+                self.memory_cache.set(key, value)
+        return value
+
+    def set(self, key: str, value: bytes):
+        """ Store the bytes in both tiers. """
+        self.memory_cache.set(key, value)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value)
@@ -0,0 +1,116 @@
+""" Hedged requests for short calls on the critical path.
+
+When hedging is enabled and a request has not returned by its deadline (the recent p90
+latency for that kind of request), a duplicate is sent and whichever finishes first wins;
+the other is cancelled.  The duplicates are paid for out of a budget that grows with the
+number of primary requests, which caps the extra spend at HEDGE_MAX_EXTRA_RATIO.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+# Extra requests allowed per primary request, e.g. 0.1 means at most 10% more requests
+HEDGE_MAX_EXTRA_RATIO = float(os.getenv("HEDGE_MAX_EXTRA_RATIO", "0.1"))
+# Hedges that can be saved up for a burst of slow requests
+HEDGE_MAX_BURST = float(os.getenv("HEDGE_MAX_BURST", "3"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+# Deadline used until enough latencies have been recorded for a percentile
+HEDGE_DEFAULT_DEADLINE = float(os.getenv("HEDGE_DEFAULT_DEADLINE", "6"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+class LatencyTracker:
+    """ Keeps the most recent latencies for each kind of request. """
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name: str, percentile: float, min_samples: int = HEDGE_MIN_SAMPLES):
+        """ Get the percentile of the recorded latencies, or None if there are too few. """
+        with self._lock:
+            latencies = sorted(self._latencies.get(name, ()))
+        if len(latencies) < min_samples:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+class HedgeBudget:
+    """ Every primary request earns a fraction of a hedge, and every hedge spends one. """
+    def __init__(self, ratio: float = HEDGE_MAX_EXTRA_RATIO, max_burst: float = HEDGE_MAX_BURST):
+        self.ratio = ratio
+        self.max_burst = max_burst
+        self.balance = 0.0
+        self.primary_requests = 0
+        self.hedged_requests = 0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.primary_requests += 1
+            self.balance = min(self.max_burst, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            self.hedged_requests += 1
+            return True
+
+latency_tracker = LatencyTracker()
+hedge_budget = HedgeBudget()
+
+def get_hedge_deadline(name: str) -> float:
+    """ How long to wait for the first request before sending a duplicate. """
+    deadline = latency_tracker.percentile(name, HEDGE_PERCENTILE)
+    return HEDGE_DEFAULT_DEADLINE if deadline is None else deadline
+
+async def _timed(name: str, make_request):
+    started = time.monotonic()
+    try:
+        result = await make_request()
+    except asyncio.CancelledError:
+        # The loser of a hedge took at least this long; leaving it out would drag the
+        # percentile down and make hedging ever more eager
+        latency_tracker.record(name, time.monotonic() - started)
+        raise
+    latency_tracker.record(name, time.monotonic() - started)
+    return result
+
+async def hedged_request(name: str, make_request):
+    """ Await make_request(), sending a duplicate if it is slower than the deadline for name.
+    make_request must return a new coroutine each time it is called.  Without hedging
+    enabled this just awaits a single request. """
+    if not HEDGE_ENABLED:
+        return await make_request()
+    hedge_budget.earn()
+    primary = asyncio.create_task(_timed(name, make_request))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=get_hedge_deadline(name))
+        if not done and hedge_budget.try_spend():
+            logger.debug(f"Hedging slow {name} request")
+            tasks.add(asyncio.create_task(_timed(name, make_request)))
+        first_error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel()
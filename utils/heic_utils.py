@@ -0,0 +1,31 @@
+""" Helper utils for ingesting HEIC uploads (e.g. iPhone photos) """
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pillow_heif import register_heif_opener
+from utils.upload_utils import prepare_vision_image
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+HEIC_EXTENSIONS = (".heic", ".heif")
+HEIC_WORKERS = int(os.getenv("HEIC_WORKERS", "2"))
+HEIC_DECODE_THREADS = int(os.getenv("HEIC_DECODE_THREADS", "4"))
+
+# Only the primary image is needed for the vision prompt, so skip reading the
+# thumbnail and depth images and let libheif decode the tiles on several threads
+register_heif_opener(thumbnails=False, depth_images=False, decode_threads=HEIC_DECODE_THREADS)
+
+# HEIC decodes run here rather than in the Streamlit script thread
+_heic_executor = ThreadPoolExecutor(max_workers=HEIC_WORKERS, thread_name_prefix="heic-decode")
+
+def is_heic(file_name: str) -> bool:
+    """ Check whether the uploaded file is a HEIC/HEIF image. """
+    return file_name.lower().endswith(HEIC_EXTENSIONS)
+
+async def prepare_heic_image(heic_file) -> bytes:
+    """ Decode the HEIC file in the worker pool and prepare it for the vision model.
+    Returns the downscaled JPEG bytes. """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_heic_executor, prepare_vision_image, heic_file)
@@ -0,0 +1,47 @@
+""" Content-addressed cache for generated images, keyed by the generation parameters """
+import os
+import logging
+from utils.cache_utils import LRUCache, DiskCache, TieredCache, make_cache_key
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(".cache", "images"))
+IMAGE_CACHE_DISK_ENABLED = os.getenv("IMAGE_CACHE_DISK_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_MEMORY_BYTES = int(os.getenv("IMAGE_CACHE_MEMORY_MB", "256")) * 1024 * 1024
+IMAGE_CACHE_DISK_BYTES = int(os.getenv("IMAGE_CACHE_DISK_MB", "2048")) * 1024 * 1024
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+# Shared by every session in the process
+image_cache = TieredCache(
+    LRUCache(max_bytes=IMAGE_CACHE_MEMORY_BYTES, ttl=IMAGE_CACHE_TTL),
+    DiskCache(
+        directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_DISK_BYTES, ttl=IMAGE_CACHE_TTL, suffix=".png"
+    ) if IMAGE_CACHE_DISK_ENABLED else None
+)
+
+def get_image_cache_key(
+    prompt: str, model: str, size: str, quality: str = None, style: str = None, index: int = 0
+) -> str:
+    """ Get the cache key for one generated image. """
+    return make_cache_key("image", prompt, model, size, quality, style, index)
+
+def get_cached_images(
+    prompt: str, model: str, size: str, quality: str = None, style: str = None, n: int = 1
+):
+    """ Return the PNG bytes of all n cached images, or None unless every one is cached. """
+    cached_images = []
+    for index in range(n):
+        image_bytes = image_cache.get(get_image_cache_key(prompt, model, size, quality, style, index))
+        if image_bytes is None:
+            return None
+        cached_images.append(image_bytes)
+    logger.debug(f"Image cache hit for prompt: {prompt} with model: {model} and size: {size}")
+    return cached_images
+
+def cache_images(
+    images: list, prompt: str, model: str, size: str, quality: str = None, style: str = None
+):
+    """ Store the PNG bytes of each generated image. """
+    for index, image_bytes in enumerate(images):
+        image_cache.set(get_image_cache_key(prompt, model, size, quality, style, index), image_bytes)
@@ -1,48 +1,118 @@
+import os
+import uuid
 import logging
+import asyncio
 import base64
 import io
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, Field
 import streamlit as st
 from openai import OpenAIError
-from dependencies import get_openai_client
+from dependencies import get_async_openai_client
+from utils.image_cache import get_cached_images, cache_images
+from utils.rate_limiter import scheduled_request
+from utils.metrics import span
+from utils.semantic_cache import find_similar, remember_prompt
+from utils.artifact_store import ArtifactHandle
 from PIL import Image
 
-# Create the OpenAI client
-client = get_openai_client()
-
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Decode Base64 JSON to Image
-def decode_image(image_data, image_name):
-    """ Decode the image data from the given image request. """
-    # Decode the image
-    image_bytes = base64.b64decode(image_data)
-    # Convert the bytes to an image
-    image = Image.open(io.BytesIO(image_bytes))
-    # Save the image
-    image.save(image_name)
-    return image
+# Directory to persist generated images to.  Images are only kept in memory when unset.
+IMAGE_SAVE_DIR = os.getenv("IMAGE_SAVE_DIR")
+
+# Writes the persisted images off the request path
+_save_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-save")
+
+class GeneratedImage(ArtifactHandle):
+    """ Generated Image Model.  A small handle to the original PNG bytes returned by the API,
+    which live in the artifact store (once per distinct image, within the session's memory
+    budget) rather than in st.session_state. """
+    width: int = Field(..., title="Width", description="The width of the image in pixels.")
+    height: int = Field(..., title="Height", description="The height of the image in pixels.")
+    format: str = Field("PNG", title="Format", description="The format of the stored bytes.")
+
+    @classmethod
+    def from_bytes(cls, image_bytes : bytes, shared : bool = False):
+        """ Store the bytes and return a handle to them.
+        Only the image header is read; the pixels are not decoded. """
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            width, height = header.size
+            image_format = header.format or "PNG"
+        return super().from_bytes(image_bytes, shared=shared, width=width, height=height, format=image_format)
+
+    @property
+    def image_bytes(self):
+        """ The PNG bytes, or None if they have expired from the artifact store. """
+        return self.data
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+def get_png_bytes(image : GeneratedImage) -> bytes:
+    """ Get the original PNG bytes of a generated image, or None if they have expired. """
+    return image.image_bytes
+
+def load_image(image_bytes : bytes, save_dir : str = None):
+    """ Wrap the given PNG bytes in a GeneratedImage without re-encoding them.
+    The bytes are also persisted when a save directory is given or configured. """
+    save_dir = save_dir or IMAGE_SAVE_DIR
+    if save_dir:
+        save_image_bytes(image_bytes, save_dir)
+    return GeneratedImage.from_bytes(image_bytes)
+
+def save_image_bytes(image_bytes : bytes, save_dir : str):
+    """ Write the PNG bytes to a uniquely named file in the background.
+    Returns the path the image will be written to. """
+    image_path = os.path.join(save_dir, f"{uuid.uuid4().hex}.png")
+    _save_executor.submit(_write_image_bytes, image_bytes, image_path)
+    return image_path
+
+def _write_image_bytes(image_bytes : bytes, image_path : str):
+    try:
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        with open(image_path, "wb") as image_file:
+            image_file.write(image_bytes)
+    except OSError as e:
+        logger.error(f"Error saving image to {image_path}: {e}")
 
 class ImageRequest(BaseModel):
     """ Image Request Model """
     prompt: str = Field(..., title="Prompt", description="The prompt to generate an image from.")
 
-async def generate_dalle3_image(prompt : str, size_choice : str):
+async def generate_dalle3_image(prompt : str, size_choice : str, save_dir : str = None):
     """ Generate an image from the given image request. """
     logger.debug(f"Generating image for prompt: {prompt} with size: {size_choice}")
+    cached_images = get_cached_images(prompt, "dall-e-3", size_choice, "standard", "vivid") or find_similar(
+        "generate_dalle3_image", prompt,
+        lambda similar_prompt: get_cached_images(similar_prompt, "dall-e-3", size_choice, "standard", "vivid"),
+        variant=size_choice
+    )
+    if cached_images:
+        return load_image(cached_images[0], save_dir)
+    client = get_async_openai_client()
     # Generate the image
     try:
-        response = client.images.generate(
-            prompt=prompt,
-            model="dall-e-3",
-            size=size_choice,
-            quality="standard",
-            n=1,
-            style="vivid",
-            response_format="b64_json"
+        with span("generate_dalle3_image", size=size_choice):
+            response = await scheduled_request(
+                client.images.with_raw_response.generate,
+                prompt=prompt,
+                model="dall-e-3",
+                size=size_choice,
+                quality="standard",
+                n=1,
+                style="vivid",
+                response_format="b64_json"
+            )
+        with span("image_decode"):
+            image_bytes = base64.b64decode(response.data[0].b64_json)
+            decoded_image = load_image(image_bytes, save_dir)
+        await asyncio.to_thread(
+            cache_images, [image_bytes], prompt, "dall-e-3", size_choice, "standard", "vivid"
         )
-        decoded_image = decode_image(image_data=response.data[0].b64_json, image_name="image.png")
+        remember_prompt("generate_dalle3_image", prompt, variant=size_choice)
 
         return decoded_image
 
@@ -50,23 +120,53 @@ async def generate_dalle3_image(prompt : str, size_choice : str):
         logger.error(f"Error generating image: {e}")
         return {"error": str(e)}
 
-async def generate_dalle2_images(prompt : str):
+async def generate_dalle3_images(prompt : str, size_choices : list, save_dir : str = None):
+    """ Generate one image per size choice concurrently.
+    Yields (index, image) tuples in the order the images finish. """
+    async def _generate(index : int, size_choice : str):
+        return index, await generate_dalle3_image(prompt=prompt, size_choice=size_choice, save_dir=save_dir)
+
+    tasks = [
+        asyncio.create_task(_generate(index, size_choice))
+        for index, size_choice in enumerate(size_choices)
+    ]
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            yield await next_finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def generate_dalle2_images(prompt : str, save_dir : str = None):
     """ Generate an image from the given image request. """
     image_list = []
     logger.debug(f"Generating images for prompt: {prompt}")
+    cached_images = get_cached_images(prompt, "dall-e-2", "1024x1024", n=3)
+    if cached_images:
+        image_list = [
+            load_image(image_bytes, save_dir) for image_bytes in cached_images
+        ]
+        st.session_state.generated_images = image_list
+        return image_list
+    client = get_async_openai_client()
     # Generate the image
     try:
-        response = client.images.generate(
-            prompt=prompt,
-            model="dall-e-2",
-            size="1024x1024",
-            n=3,
-            response_format="b64_json"
-        )
+        with span("generate_dalle2_images"):
+            response = await scheduled_request(
+                client.images.with_raw_response.generate,
+                prompt=prompt,
+                model="dall-e-2",
+                size="1024x1024",
+                n=3,
+                response_format="b64_json"
+            )
+        with span("image_decode"):
+            images_bytes = [base64.b64decode(response.data[i].b64_json) for i in range(3)]
+        await asyncio.to_thread(cache_images, images_bytes, prompt, "dall-e-2", "1024x1024")
         for i in range(3):
             returned_image = response.data[i].b64_json[:100]
             logger.debug(f"Returned image: {returned_image}")
-            decoded_image = decode_image(image_data=response.data[i].b64_json, image_name=f"image{i}.png")
+            decoded_image = load_image(images_bytes[i], save_dir)
             image_list.append(decoded_image)
             logging.debug(f"Decoded image: {decoded_image}")
 
@@ -0,0 +1,88 @@
+""" Incremental parser for JSON objects streamed from the model """
+import json
+
+class JSONFieldStreamParser:
+    """ Parses a JSON object as it streams in and reports each top-level field as soon as
+    its value is complete, e.g. "post" can be used before "image_prompt" has arrived. """
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Where we are within the top-level object: "key", "colon" or "value"
+        self._phase = "key"
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+
+    def feed(self, delta: str) -> list:
+        """ Add the next streamed chunk of text.
+        Returns the (key, value) pairs of the fields completed by this chunk. """
+        completed_fields = []
+        if not delta or self.done:
+            return completed_fields
+        self.text += delta
+        while self._position < len(self.text) and not self.done:
+            field = self._step(self.text[self._position], self._position)
+            if field is not None:
+                completed_fields.append(field)
+            self._position += 1
+        return completed_fields
+
+    def _step(self, char: str, index: int):
+        """ Advance the parser by one character, returning a completed field if there is one. """
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1 and self._phase == "key":
+                    self._key = json.loads(self.text[self._key_start:index + 1])
+                    self._phase = "colon"
+                elif self._depth == 1 and self._phase == "value":
+                    return self._complete_value(index + 1)
+            return None
+        if char == '"':
+            self._in_string = True
+            if self._depth == 1 and self._phase == "key":
+                self._key_start = index
+            elif self._depth == 1 and self._phase == "value" and self._value_start is None:
+                self._value_start = index
+        elif char in "{[":
+            if self._depth == 1 and self._phase == "value" and self._value_start is None:
+                self._value_start = index
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._phase == "value" and self._value_start is not None:
+                return self._complete_value(index + 1)
+            if self._depth == 0:
+                self.done = True
+                if self._phase == "value" and self._value_start is not None:
+                    return self._complete_value(index)
+        elif self._depth == 1:
+            if char == ":" and self._phase == "colon":
+                self._phase = "value"
+                self._value_start = None
+            elif char == ",":
+                field = None
+                if self._phase == "value" and self._value_start is not None:
+                    field = self._complete_value(index)
+                self._phase = "key"
+                return field
+            elif not char.isspace() and self._phase == "value" and self._value_start is None:
+                # Start of a number, true, false or null
+                self._value_start = index
+        return None
+
+    def _complete_value(self, end: int):
+        """ Decode the value that ends at the given index and reset for the next field. """
+        value = json.loads(self.text[self._value_start:end])
+        field = (self._key, value)
+        self._phase = "after_value"
+        self._value_start = None
+        return field
@@ -0,0 +1,188 @@
+""" Lightweight per-stage latency metrics.
+
+Stages are timed with span() (or recorded directly with record_duration()) and kept in a
+rolling window per stage for the admin page; events such as cache hits are counted with
+increment_counter().  They can also be exported:
+    METRICS_JSONL_PATH      append one JSON line per timed span to this file
+    METRICS_PROMETHEUS_PORT serve the Prometheus text format on this port at /metrics
+    METRICS_PROMETHEUS_HOST the address to serve it on (default 127.0.0.1, local only)
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+METRICS_PROMETHEUS_PORT = os.getenv("METRICS_PROMETHEUS_PORT")
+METRICS_PROMETHEUS_HOST = os.getenv("METRICS_PROMETHEUS_HOST", "127.0.0.1")
+# Recent durations kept per stage for the percentiles
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+def get_percentile(values: list, quantile: float) -> float:
+    """ Nearest-rank percentile of already sorted values. """
+    index = max(0, math.ceil(quantile * len(values)) - 1)
+    return values[index]
+
+class StageMetrics:
+    """ Durations recorded per stage: a rolling window for the percentiles plus running
+    totals for the Prometheus count and sum. """
+    def __init__(self, window: int = METRICS_WINDOW, jsonl_path: str = None):
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self._durations = {}
+        self._totals = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._jsonl_file = None
+        # The single writer of the JSONL file, so recording never waits on disk I/O
+        self._jsonl_executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-jsonl") if jsonl_path else None
+        )
+
+    def record(self, stage: str, seconds: float, **labels):
+        with self._lock:
+            self._durations.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            count, total = self._totals.get(stage, (0, 0.0))
+            self._totals[stage] = (count + 1, total + seconds)
+        if self.jsonl_path:
+            self._jsonl_executor.submit(
+                self._write_jsonl, {"ts": time.time(), "stage": stage, "seconds": seconds, **labels}
+            )
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def counters(self) -> dict:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def summary(self) -> dict:
+        """ Get the count and p50/p95/p99 (in seconds) of each stage. """
+        with self._lock:
+            snapshot = {stage: sorted(durations) for stage, durations in self._durations.items()}
+            totals = dict(self._totals)
+        return {
+            stage: {
+                "count": totals[stage][0],
+                **{f"p{round(quantile * 100)}": get_percentile(durations, quantile) for quantile in QUANTILES}
+            }
+            for stage, durations in sorted(snapshot.items()) if durations
+        }
+
+    def render_prometheus(self) -> str:
+        """ Render the metrics as a Prometheus summary in the text exposition format. """
+        with self._lock:
+            snapshot = {stage: sorted(durations) for stage, durations in self._durations.items()}
+            totals = dict(self._totals)
+        lines = [
+            "# HELP instalicious_stage_seconds Time spent in each stage of the generation path.",
+            "# TYPE instalicious_stage_seconds summary",
+        ]
+        for stage, durations in sorted(snapshot.items()):
+            for quantile in QUANTILES:
+                lines.append(
+                    f'instalicious_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                    f"{get_percentile(durations, quantile)}"
+                )
+            count, total = totals[stage]
+            lines.append(f'instalicious_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'instalicious_stage_seconds_count{{stage="{stage}"}} {count}')
+        counters = self.counters()
+        if counters:
+            lines.append("# HELP instalicious_events_total Events counted on the generation path.")
+            lines.append("# TYPE instalicious_events_total counter")
+            for counter, value in counters.items():
+                lines.append(f'instalicious_events_total{{event="{counter}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def _write_jsonl(self, entry: dict):
+        if not self.jsonl_path:
+            # An earlier write failed
+            return
+        try:
+            if self._jsonl_file is None:
+                self._jsonl_file = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+            self._jsonl_file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.jsonl_path}: {e}")
+            self.jsonl_path = None
+
+metrics = StageMetrics(jsonl_path=METRICS_JSONL_PATH)
+
+def record_duration(stage: str, seconds: float, **labels):
+    """ Record a duration measured elsewhere, e.g. a time to first token. """
+    metrics.record(stage, seconds, **labels)
+
+def increment_counter(counter: str, amount: int = 1):
+    """ Count an event, e.g. a cache hit. """
+    metrics.increment(counter, amount)
+
+@contextmanager
+def span(stage: str, **labels):
+    """ Time the block as the given stage.  Works around awaits as well, since only the
+    wall-clock time between entering and leaving the block is measured. """
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        if error:
+            labels["error"] = error
+        metrics.record(stage, time.perf_counter() - started, **labels)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server_lock = threading.Lock()
+_server = None
+
+def start_prometheus_server(port: int, host: str = METRICS_PROMETHEUS_HOST):
+    """ Serve /metrics on the host and port from a daemon thread (once per process). """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Another process (e.g. a second Streamlit worker) already has the port
+            logger.warning(f"Could not serve metrics on port {port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on {host}:{port}")
+        return _server
+
+if METRICS_PROMETHEUS_PORT:
+    start_prometheus_server(int(METRICS_PROMETHEUS_PORT))
@@ -0,0 +1,219 @@
+""" Persistent history of the generated posts, searchable by prompt, post text and hashtags.
+
+Posts are kept in a SQLite database with an FTS5 index over the prompt, post and hashtags,
+and their images in a content-addressed directory (one PNG and one WebP thumbnail per
+distinct image, named by the sha256 digest of the PNG).  Posts are recorded on a single
+background writer thread, so recording never holds up a rerun and SQLite only ever has
+one writer.
+"""
+import io
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from utils.asset_utils import build_thumbnail
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+POST_HISTORY_ENABLED = os.getenv("POST_HISTORY_ENABLED", "true").lower() == "true"
+POST_HISTORY_DIR = os.getenv("POST_HISTORY_DIR", os.path.join(".cache", "history"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    session_id TEXT,
+    model TEXT,
+    prompt TEXT NOT NULL,
+    image_prompt TEXT,
+    post TEXT NOT NULL,
+    hashtags TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS post_images (
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    nbytes INTEGER,
+    PRIMARY KEY (post_id, position)
+);
+CREATE INDEX IF NOT EXISTS posts_created_at ON posts(created_at);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    prompt, post, hashtags, content='posts', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts(rowid, prompt, post, hashtags) VALUES (new.id, new.prompt, new.post, new.hashtags);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts(posts_fts, rowid, prompt, post, hashtags)
+    VALUES ('delete', old.id, old.prompt, old.post, old.hashtags);
+END;
+"""
+
+def get_hashtags(post: str) -> list:
+    """ The distinct hashtags in the post, in order of appearance. """
+    return list(dict.fromkeys(re.findall(r"#\w+", post)))
+
+def make_match_query(query: str) -> str:
+    """ Turn free text into an FTS5 query matching every word as a prefix, so user input
+    never trips the FTS5 query syntax. """
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query))
+
+class PostHistory:
+    """ SQLite post history with an FTS5 index and a content-addressed image directory.
+    Every thread gets its own connection. """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.db_path = os.path.join(directory, "posts.sqlite3")
+        self.image_dir = os.path.join(directory, "images")
+        self._local = threading.local()
+        os.makedirs(self.image_dir, exist_ok=True)
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            # Some SQLite builds lack FTS5; search then falls back to LIKE
+            logger.warning(f"FTS5 is not available, post search will be slower: {e}")
+            self.fts_enabled = False
+
+    def record_post(
+        self, prompt: str, post: str, images: list = (), image_prompt: str = None,
+        model: str = None, session_id: str = None
+    ) -> int:
+        """ Save the post and the PNG bytes of its images.  Returns the post's id. """
+        stored_images = [self._store_image(image_bytes) for image_bytes in images]
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO posts (created_at, session_id, model, prompt, image_prompt, post, hashtags) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), session_id, model, prompt, image_prompt, post, " ".join(get_hashtags(post)))
+            )
+            post_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO post_images (post_id, position, digest, width, height, nbytes) VALUES (?, ?, ?, ?, ?, ?)",
+                [(post_id, position, *stored_image) for position, stored_image in enumerate(stored_images)]
+            )
+        logger.debug(f"Recorded post {post_id} with {len(stored_images)} image(s)")
+        return post_id
+
+    def search(self, query: str = "", limit: int = 20, offset: int = 0) -> list:
+        """ The posts matching the query, best matches first, or the most recent posts
+        when the query is empty.  Each post is a dict with its images' metadata. """
+        match_query = make_match_query(query)
+        connection = self._connect()
+        if not match_query:
+            rows = connection.execute(
+                "SELECT * FROM posts ORDER BY created_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        elif self.fts_enabled:
+            rows = connection.execute(
+                "SELECT posts.* FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid "
+                "WHERE posts_fts MATCH ? ORDER BY bm25(posts_fts), posts.created_at DESC LIMIT ? OFFSET ?",
+                (match_query, limit, offset)
+            ).fetchall()
+        else:
+            terms = re.findall(r"\w+", query)
+            condition = " AND ".join("(prompt || ' ' || post || ' ' || hashtags) LIKE ?" for _ in terms)
+            rows = connection.execute(
+                f"SELECT * FROM posts WHERE {condition} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (*[f"%{term}%" for term in terms], limit, offset)
+            ).fetchall()
+        posts = [dict(row) for row in rows]
+        for post in posts:
+            post["images"] = self.get_images(post["id"])
+        return posts
+
+    def get_images(self, post_id: int) -> list:
+        rows = self._connect().execute(
+            "SELECT digest, width, height, nbytes FROM post_images WHERE post_id = ? ORDER BY position",
+            (post_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def get_image_bytes(self, digest: str):
+        """ The PNG bytes of the image, or None if the file is missing. """
+        return self._read_file(self._image_path(digest, ".png"))
+
+    def get_thumbnail_bytes(self, digest: str):
+        """ The WebP thumbnail of the image, or None if the file is missing. """
+        return self._read_file(self._image_path(digest, ".webp"))
+
+    def _store_image(self, image_bytes: bytes) -> tuple:
+        """ Write the image and its thumbnail, unless an identical image is already stored.
+        Returns the image's (digest, width, height, size in bytes). """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        image_path = self._image_path(digest, ".png")
+        thumbnail_path = self._image_path(digest, ".webp")
+        if not os.path.exists(thumbnail_path):
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            self._write_file(image_path, image_bytes)
+            self._write_file(thumbnail_path, build_thumbnail(io.BytesIO(image_bytes)))
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            width, height = header.size
+        return digest, width, height, len(image_bytes)
+
+    def _image_path(self, digest: str, suffix: str) -> str:
+        # Two levels keep the directories small
+        return os.path.join(self.image_dir, digest[:2], f"{digest}{suffix}")
+
+    def _write_file(self, path: str, data: bytes):
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as output_file:
+            output_file.write(data)
+        os.replace(temp_path, path)
+
+    def _read_file(self, path: str):
+        try:
+            with open(path, "rb") as input_file:
+                return input_file.read()
+        except OSError:
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+# Shared by every session in the process
+post_history = PostHistory(POST_HISTORY_DIR) if POST_HISTORY_ENABLED else None
+
+# The single writer of the history database
+_history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="post-history")
+
+def record_post_in_background(
+    prompt: str, post: str, images: list = (), image_prompt: str = None,
+    model: str = None, session_id: str = None
+):
+    """ Record the post off the request path.  Does nothing if the history is disabled. """
+    if post_history is None:
+        return None
+    future = _history_executor.submit(
+        post_history.record_post, prompt, post, list(images), image_prompt, model, session_id
+    )
+    future.add_done_callback(_log_record_error)
+    return future
+
+def _log_record_error(future):
+    if future.exception() is not None:
+        logger.error(f"Error recording post history: {future.exception()}")
@@ -1,13 +1,17 @@
 """ Helper utils for post related functions """
+import time
 import logging
-import json
 from pydantic import BaseModel, Field
 from openai import OpenAIError
 import streamlit as st
-from dependencies import get_openai_client
-
-# Create the OpenAI client
-client = get_openai_client()
+from dependencies import get_async_openai_client
+from utils.upload_utils import build_image_data_url
+from utils.json_stream import JSONFieldStreamParser
+from utils.prompt_cache import get_prompt_cache_key, get_cached_prompt, cache_prompt
+from utils.rate_limiter import scheduled_request, estimate_chat_tokens
+from utils.hedge_utils import hedged_request
+from utils.metrics import span, record_duration
+from utils.semantic_cache import find_similar, remember_prompt
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -124,21 +128,42 @@ async def get_messages(post_option: str, prompt: str):
     return total_messages
 
 
+async def stream_post(post_type: str, prompt: str):
+    """ Stream a post based on a user prompt.  Yields (field, value) pairs as soon as each
+    field of the JSON response is complete, so that e.g. image generation can start as
+    soon as "image_prompt" arrives without waiting for the rest of the response. """
+    messages = await get_messages(post_type, prompt)
+    client = get_async_openai_client()
+    started = time.perf_counter()
+    first_token = True
+    completion = await scheduled_request(
+        client.chat.completions.with_raw_response.create,
+        estimate_chat_tokens(messages, 750),
+        model="gpt-4-turbo-preview",
+        messages=messages,
+        temperature=0.75,
+        top_p=1,
+        max_tokens=750,
+        response_format={"type": "json_object"},
+        stream=True
+    )
+    parser = JSONFieldStreamParser()
+    async for chunk in completion:
+        if first_token and chunk.choices[0].delta.content:
+            record_duration("post_first_token", time.perf_counter() - started, post_type=post_type)
+            first_token = False
+        for field, value in parser.feed(chunk.choices[0].delta.content):
+            logger.debug(f"Streamed field: {field}")
+            yield field, value
+    record_duration("post_stream_total", time.perf_counter() - started, post_type=post_type)
+
 async def create_post(post_type: str, prompt: str):
     """ Generate a post based on a user prompt"""
-    messages = await get_messages(post_type, prompt)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
-            temperature=0.75,
-            top_p=1,
-            max_tokens=750,
-            response_format={"type": "json_object"}
-        )
-        post_response = json.loads(response.choices[0].message.content)
+        post_response = {}
+        async for field, value in stream_post(post_type, prompt):
+            post_response[field] = value
         logger.debug(f"Response: {post_response}")
-        logger.debug(f"Response type: {type(post_response)}")
         return {
             "post": post_response["post"], "hashtags": post_response["hashtags"],
             "image_prompt": post_response["image_prompt"] if "image_prompt" in post_response else None
@@ -151,9 +176,14 @@ async def create_post(post_type: str, prompt: str):
     logger.warning("All models failed. Returning None.")
     return None
 
-async def alter_image(prompt: str, image_url: str):
+async def alter_image(prompt: str, image_bytes: bytes):
     """ Generate a new dall-e prompt based on the user prompt and the image """
     st.session_state.vision_status = "used"
+    cache_key = get_prompt_cache_key("alter_image", prompt, image_bytes)
+    cached_prompt = get_cached_prompt(cache_key)
+    if cached_prompt:
+        st.session_state.vision_prompt = cached_prompt
+        return cached_prompt
     messages = [
         {
             "role": "system", "content": [
@@ -189,22 +219,26 @@ async def alter_image(prompt: str, image_url: str):
                     "type" : "text", "text" : "This is the image that was passed to you:"
                 },
                 {
-                    "type" : "image_url", "image_url" : f"""data:image/jpeg;base64,
-                    {st.session_state.user_image_string}"""
+                    "type" : "image_url", "image_url" : build_image_data_url(image_bytes)
                 }
             ]
         }
     ]
-
+    client = get_async_openai_client()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=messages,
-            max_tokens=250,
-        )
+        # This call holds up image generation, so a slow one is hedged
+        with span("alter_image"):
+            response = await hedged_request("alter_image", lambda: scheduled_request(
+                client.chat.completions.with_raw_response.create,
+                estimate_chat_tokens(messages, 250),
+                model="gpt-4-vision-preview",
+                messages=messages,
+                max_tokens=250,
+            ))
         logger.debug(f"Response: {response}")
         prompt_response = response.choices[0].message.content
         logger.debug(f"Prompt response: {prompt_response}")
+        cache_prompt(cache_key, prompt_response)
         st.session_state.vision_prompt = prompt_response
         return prompt_response
     except OpenAIError as e:
@@ -212,6 +246,13 @@ async def alter_image(prompt: str, image_url: str):
         return None
 
 async def get_image_prompt(post_prompt: str):
+    cache_key = get_prompt_cache_key("get_image_prompt", post_prompt)
+    cached_prompt = get_cached_prompt(cache_key) or find_similar(
+        "get_image_prompt", post_prompt,
+        lambda similar_prompt: get_cached_prompt(get_prompt_cache_key("get_image_prompt", similar_prompt))
+    )
+    if cached_prompt:
+        return cached_prompt
     messages = [
         {
             "role": "system", "content": f"""The user has provided a prompt {post_prompt} that they
@@ -238,23 +279,34 @@ async def get_image_prompt(post_prompt: str):
                     descriptive enough to generate the desired photo."""
         }
     ]
+    client = get_async_openai_client()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
-            max_tokens=250,
-        )
+        with span("get_image_prompt"):
+            response = await hedged_request("get_image_prompt", lambda: scheduled_request(
+                client.chat.completions.with_raw_response.create,
+                estimate_chat_tokens(messages, 250),
+                model="gpt-4-turbo-preview",
+                messages=messages,
+                max_tokens=250,
+            ))
         logger.debug(f"Response: {response}")
         prompt_response = response.choices[0].message.content
         logger.debug(f"Prompt response: {prompt_response}")
+        cache_prompt(cache_key, prompt_response)
+        remember_prompt("get_image_prompt", post_prompt)
         return prompt_response
     except OpenAIError as e:
         logger.error(f"Error generating prompt for image generation: {e}")
         return None
 
-async def alter_image2(prompt: str, image_url: str):
+async def alter_image2(prompt: str, image_bytes: bytes):
     """ Generate a new dall-e prompt based on the user prompt and the image """
     st.session_state.vision_status = "used"
+    cache_key = get_prompt_cache_key("alter_image2", prompt, image_bytes)
+    cached_prompt = get_cached_prompt(cache_key)
+    if cached_prompt:
+        st.session_state.vision_prompt = cached_prompt
+        return cached_prompt
     messages = [
         {
             "role": "system", "content": [
@@ -280,34 +332,37 @@ async def alter_image2(prompt: str, image_url: str):
                     "type" : "text", "text" : "This is the image that was passed to you:"
                 },
                 {
-                    "type" : "image_url", "image_url" : f"""data:image/jpeg;base64,
-                    {st.session_state.user_image_string}"""
+                    "type" : "image_url", "image_url" : build_image_data_url(image_bytes)
                 }
             ]
         }
     ]
-    i = 0
-    while i <= 3:
-        try:
-            response = client.chat.completions.create(
+    client = get_async_openai_client()
+    try:
+        with span("alter_image2"):
+            response = await scheduled_request(
+                client.chat.completions.with_raw_response.create,
+                estimate_chat_tokens(messages, 250),
                 model="gpt-4-vision-preview",
                 messages=messages,
                 max_tokens=250,
             )
-            logger.debug(f"Response: {response}")
-            prompt_response = response.choices[0].message.content
-            logger.debug(f"Prompt response: {prompt_response}")
-            st.session_state.vision_prompt = prompt_response
-            return prompt_response
-        except OpenAIError as e:
-            logger.error(f"Error generating prompt for image alteration: {e}")
-            i += 1
-            continue
-    # If all of the models fail, return the original prompt
+        logger.debug(f"Response: {response}")
+        prompt_response = response.choices[0].message.content
+        logger.debug(f"Prompt response: {prompt_response}")
+        cache_prompt(cache_key, prompt_response)
+        st.session_state.vision_prompt = prompt_response
+        return prompt_response
+    except OpenAIError as e:
+        logger.error(f"Error generating prompt for image alteration: {e}")
+    # If the request fails even after retrying, return the original prompt
     return prompt
 
 async def get_image_prompt2(post_prompt: str):
-    i = 0
+    cache_key = get_prompt_cache_key("get_image_prompt2", post_prompt)
+    cached_prompt = get_cached_prompt(cache_key)
+    if cached_prompt:
+        return cached_prompt
     messages = [
         {
             "role" : "system",
@@ -323,20 +378,22 @@ async def get_image_prompt2(post_prompt: str):
                     photo, not an illustration or drawing."""
         }
     ]
-    while i <= 3:
-        try:
-            response = client.chat.completions.create(
+    client = get_async_openai_client()
+    try:
+        with span("get_image_prompt2"):
+            response = await scheduled_request(
+                client.chat.completions.with_raw_response.create,
+                estimate_chat_tokens(messages, 250),
                 model="gpt-4-turbo-preview",
                 messages=messages,
                 max_tokens=250,
             )
-            logger.debug(f"Response: {response}")
-            prompt_response = response.choices[0].message.content
-            logger.debug(f"Prompt response: {prompt_response}")
-            return prompt_response
-        except OpenAIError as e:
-            logger.error(f"Error generating prompt for image generation: {e}")
-            i += 1
-            continue
-    # If all of the models fail, return the original prompt
+        logger.debug(f"Response: {response}")
+        prompt_response = response.choices[0].message.content
+        logger.debug(f"Prompt response: {prompt_response}")
+        cache_prompt(cache_key, prompt_response)
+        return prompt_response
+    except OpenAIError as e:
+        logger.error(f"Error generating prompt for image generation: {e}")
+    # If the request fails even after retrying, return the original prompt
     return post_prompt
@@ -0,0 +1,46 @@
+""" Memoization cache for the LLM prompt-rewriting calls """
+import os
+import hashlib
+import logging
+from utils.cache_utils import LRUCache, DiskCache, TieredCache, make_cache_key
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", os.path.join(".cache", "prompts"))
+PROMPT_CACHE_DISK_ENABLED = os.getenv("PROMPT_CACHE_DISK_ENABLED", "false").lower() == "true"
+PROMPT_CACHE_MEMORY_BYTES = int(os.getenv("PROMPT_CACHE_MEMORY_MB", "16")) * 1024 * 1024
+PROMPT_CACHE_DISK_BYTES = int(os.getenv("PROMPT_CACHE_DISK_MB", "64")) * 1024 * 1024
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+
+# Shared by every session in the process.  Values are stored as utf-8 bytes.
+prompt_cache = TieredCache(
+    LRUCache(max_bytes=PROMPT_CACHE_MEMORY_BYTES, ttl=PROMPT_CACHE_TTL),
+    DiskCache(
+        directory=PROMPT_CACHE_DIR, max_bytes=PROMPT_CACHE_DISK_BYTES, ttl=PROMPT_CACHE_TTL, suffix=".txt"
+    ) if PROMPT_CACHE_DISK_ENABLED else None
+)
+
+def get_image_digest(image) -> str:
+    """ Get the sha256 digest of the image data (bytes or a base64 string). """
+    if isinstance(image, str):
+        image = image.encode("utf-8")
+    return hashlib.sha256(image).hexdigest()
+
+def get_prompt_cache_key(rewrite_type: str, prompt: str, image=None) -> str:
+    """ Get the cache key for a prompt rewrite.  Vision rewrites are keyed by the image digest. """
+    image_digest = get_image_digest(image) if image else None
+    return make_cache_key("prompt", rewrite_type, prompt, image_digest)
+
+def get_cached_prompt(cache_key: str):
+    """ Return the memoized rewrite for the cache key, or None on a miss. """
+    cached_prompt = prompt_cache.get(cache_key)
+    if cached_prompt is None:
+        return None
+    logger.debug(f"Prompt cache hit for key: {cache_key}")
+    return cached_prompt.decode("utf-8")
+
+def cache_prompt(cache_key: str, prompt: str):
+    """ Memoize the rewritten prompt. """
+    if prompt:
+        prompt_cache.set(cache_key, prompt.encode("utf-8"))
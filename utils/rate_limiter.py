@@ -0,0 +1,234 @@
+""" Shared, rate-limit-aware scheduler for OpenAI requests.
+
+Every request waits for admission from per-model token buckets (requests per minute and
+tokens per minute).  The buckets start from conservative defaults and are corrected from
+the x-ratelimit-* headers of each response.  Requests waiting on the same model are
+admitted round-robin across sessions, so one busy session cannot starve the others.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from openai import RateLimitError
+from utils.retry_utils import call_with_retries
+from utils.artifact_store import get_session_id
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
+# How often queued requests check whether it is their turn
+POLL_INTERVAL = 0.05
+# Rough token cost of one image in a vision request
+VISION_IMAGE_TOKENS = 765
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_reset_duration(value: str) -> float:
+    """ Parse an x-ratelimit-reset-* header value such as "1s", "6m0s" or "20ms" into seconds. """
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_PATTERN.findall(value))
+
+def estimate_chat_tokens(messages: list, max_tokens: int = None) -> int:
+    """ Roughly estimate the tokens a chat request will use (about 4 characters per token). """
+    prompt_chars = 0
+    image_count = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            prompt_chars += len(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                prompt_chars += len(part["text"])
+            else:
+                image_count += 1
+    return prompt_chars // 4 + image_count * VISION_IMAGE_TOKENS + (max_tokens or 0)
+
+class TokenBucket:
+    """ A token bucket that refills continuously up to its per-minute capacity.
+    Not thread-safe on its own; the scheduler holds its lock while using it. """
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        """ Seconds until the amount is available (0 if it is available now). """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def update(self, limit: float, remaining: float, reset_seconds: float = None):
+        """ Correct the bucket from the limit, remaining and reset values reported by the API. """
+        self._refill()
+        self.capacity = limit
+        self.level = min(self.level, remaining)
+        if remaining < 1 and reset_seconds:
+            # Exhausted: hold back until the API says the limit resets
+            self.hold(reset_seconds)
+
+    def hold(self, seconds: float):
+        """ Make the bucket wait at least the given seconds before admitting anything. """
+        self._refill()
+        self.level = min(self.level, 1 - seconds * self.capacity / 60)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+class RequestScheduler:
+    """ Admits requests per model against request and token buckets, round-robin across sessions. """
+    def __init__(
+        self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        # model -> (requests bucket, tokens bucket)
+        self._buckets = {}
+        # model -> session id -> queued tickets; the first session is the next to be served
+        self._queues = {}
+        self._queue_listeners = {}
+
+    def set_queue_listener(self, session_id: str, listener):
+        """ Register a callback that is called with the session's queue position while it waits
+        (and with 0 once it is admitted).  Pass None to remove it. """
+        with self._lock:
+            if listener is None:
+                self._queue_listeners.pop(session_id, None)
+            else:
+                self._queue_listeners[session_id] = listener
+
+    async def acquire(self, model: str, tokens: int = 0, session_id: str = None):
+        """ Wait until the request is admitted. """
+        session_id = session_id or get_session_id()
+        ticket = object()
+        with self._lock:
+            self._queues.setdefault(model, OrderedDict()).setdefault(session_id, deque()).append(ticket)
+        waited = False
+        last_position = None
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_admit(model, session_id, ticket, tokens)
+                    # Report where the session's next request is, not this particular one
+                    position = self._queue_position(model, session_id) if wait else 0
+                    listener = self._queue_listeners.get(session_id)
+                if listener and position != last_position and (waited or wait):
+                    listener(position)
+                last_position = position
+                if not wait:
+                    if waited:
+                        logger.debug(f"Admitted request for {model} from session {session_id}")
+                    return
+                waited = True
+                await asyncio.sleep(min(wait, POLL_INTERVAL))
+        finally:
+            with self._lock:
+                self._remove_ticket(model, session_id, ticket)
+
+    def update_from_headers(self, model: str, headers):
+        """ Seed the model's buckets from the x-ratelimit-* headers of a response. """
+        with self._lock:
+            requests_bucket, tokens_bucket = self._get_buckets(model)
+            for bucket, kind in ((requests_bucket, "requests"), (tokens_bucket, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                reset = headers.get(f"x-ratelimit-reset-{kind}")
+                if limit is None or remaining is None:
+                    continue
+                try:
+                    bucket.update(
+                        float(limit), float(remaining), parse_reset_duration(reset) if reset else None
+                    )
+                except ValueError:
+                    logger.warning(f"Could not parse rate limit headers for {model}: {limit}, {remaining}")
+
+    def penalize(self, model: str, delay: float):
+        """ Hold back every request for the model for delay seconds, e.g. after a 429. """
+        with self._lock:
+            requests_bucket, _ = self._get_buckets(model)
+            requests_bucket.hold(delay)
+
+    def _get_buckets(self, model: str):
+        if model not in self._buckets:
+            self._buckets[model] = (
+                TokenBucket(self.requests_per_minute), TokenBucket(self.tokens_per_minute)
+            )
+        return self._buckets[model]
+
+    def _try_admit(self, model: str, session_id: str, ticket, tokens: int) -> float:
+        """ Admit the ticket if it is next in line and the buckets allow it.
+        Returns 0 if admitted, otherwise how long to wait before trying again. """
+        queues = self._queues[model]
+        next_session = next(iter(queues))
+        if next_session != session_id or queues[session_id][0] is not ticket:
+            return POLL_INTERVAL
+        requests_bucket, tokens_bucket = self._get_buckets(model)
+        wait = max(requests_bucket.wait_time(1), tokens_bucket.wait_time(tokens))
+        if wait:
+            return wait
+        requests_bucket.take(1)
+        tokens_bucket.take(tokens)
+        queues[session_id].popleft()
+        # Move the session to the back of the rotation
+        session_tickets = queues.pop(session_id)
+        if session_tickets:
+            queues[session_id] = session_tickets
+        return 0
+
+    def _queue_position(self, model: str, session_id: str) -> int:
+        """ The 1-based position of the session's next request in the round-robin order. """
+        position = 1
+        for other_session in self._queues[model]:
+            if other_session == session_id:
+                break
+            position += 1
+        return position
+
+    def _remove_ticket(self, model: str, session_id: str, ticket):
+        queues = self._queues.get(model, {})
+        tickets = queues.get(session_id)
+        if tickets is None:
+            return
+        if ticket in tickets:
+            tickets.remove(ticket)
+        if not tickets:
+            del queues[session_id]
+
+# Shared by every session in the process
+scheduler = RequestScheduler()
+
+async def scheduled_request(create, estimated_tokens: int = 0, **kwargs):
+    """ Send a request through the scheduler, admitted against the buckets of kwargs["model"].
+    `create` must be a with_raw_response method (e.g. client.chat.completions.with_raw_response.create)
+    so the rate limit headers can be read; the parsed response (or stream) is returned.
+    Transient failures are retried under the shared retry policy, each retry waiting for
+    admission again. """
+    model = kwargs["model"]
+
+    async def send():
+        await scheduler.acquire(model, estimated_tokens)
+        try:
+            raw_response = await create(**kwargs)
+        except RateLimitError as e:
+            scheduler.update_from_headers(model, e.response.headers)
+            raise
+        scheduler.update_from_headers(model, raw_response.headers)
+        return raw_response.parse()
+
+    return await call_with_retries(
+        send, model, on_retry_after=lambda delay: scheduler.penalize(model, delay)
+    )
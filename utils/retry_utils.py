@@ -0,0 +1,195 @@
+""" Shared retry policy and circuit breaker for OpenAI requests.
+
+Every OpenAI call site goes through call_with_retries (or call_with_retries_sync), and the
+clients themselves are created with max_retries=0 so retries never stack.  Transient errors
+(connection problems, timeouts, 429s, 5xx) are retried with capped exponential backoff and
+full jitter, honoring Retry-After when the API sends it.  Client errors such as 400s and
+content policy rejections are raised straight away.  Sustained failures open a breaker per
+model so further requests fail fast instead of hammering the API.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from openai import (
+    OpenAIError, APIConnectionError, APIStatusError, RateLimitError, InternalServerError, ConflictError
+)
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("OPENAI_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+# Retry-After values above this are treated as "not worth waiting for"
+RETRY_AFTER_MAX = float(os.getenv("OPENAI_RETRY_AFTER_MAX", "60"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("OPENAI_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+
+class CircuitOpenError(OpenAIError):
+    """ Raised instead of sending a request while the breaker for its model is open. """
+
+def is_retryable(error: Exception) -> bool:
+    """ Check whether the error is transient and worth retrying. """
+    if isinstance(error, RateLimitError):
+        # Running out of quota will not fix itself by waiting
+        return error.code != "insufficient_quota"
+    if isinstance(error, (APIConnectionError, InternalServerError, ConflictError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return False
+
+def get_retry_after(error: Exception):
+    """ Get the delay in seconds the API asked for in the error response, if any. """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            return parsedate_to_datetime(retry_after).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+def get_retry_delay(attempt: int, error: Exception) -> float:
+    """ Get how long to wait before the given retry (1 for the first retry). """
+    retry_after = get_retry_after(error)
+    if retry_after is not None and 0 <= retry_after <= RETRY_AFTER_MAX:
+        # Spread out the retries of requests that were all told the same thing
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+class CircuitBreaker:
+    """ Opens after a run of consecutive transient failures.  While open every request fails
+    fast; after the reset timeout a single trial request is let through, and its result
+    closes or re-opens the breaker. """
+    def __init__(
+        self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_request(self):
+        """ Raise CircuitOpenError if the request should not be sent. """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                logger.info(f"Circuit breaker for {self.name} is half open, sending a trial request")
+                return
+            retry_in = max(0, self.reset_seconds - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(
+            f"{self.name} is temporarily unavailable after repeated failures, try again in {retry_in:.0f}s"
+        )
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit breaker for {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_ignored(self):
+        """ The request failed in a way that says nothing about the API's health. """
+        with self._lock:
+            self._trial_in_flight = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """ Get the shared circuit breaker for a model. """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def _handle_error(breaker: CircuitBreaker, error: Exception, attempt: int, on_retry_after) -> float:
+    """ Record the failed attempt and return the delay before retrying, or re-raise. """
+    if not is_retryable(error):
+        breaker.record_ignored()
+        raise error
+    breaker.record_failure()
+    if attempt >= RETRY_MAX_ATTEMPTS or breaker.state == "open":
+        raise error
+    delay = get_retry_delay(attempt, error)
+    if on_retry_after and isinstance(error, RateLimitError):
+        on_retry_after(delay)
+    logger.warning(
+        f"{breaker.name} request failed ({error.__class__.__name__}), "
+        f"retry {attempt}/{RETRY_MAX_ATTEMPTS - 1} in {delay:.2f}s"
+    )
+    return delay
+
+async def call_with_retries(send, name: str, on_retry_after=None):
+    """ Await send() until it succeeds, retrying transient errors under the breaker for name.
+    on_retry_after is called with the delay when the API rate limits us, so callers can hold
+    back other requests to the same model as well. """
+    breaker = get_breaker(name)
+    attempt = 1
+    while True:
+        breaker.before_request()
+        try:
+            result = await send()
+        except OpenAIError as e:
+            delay = _handle_error(breaker, e, attempt, on_retry_after)
+        except asyncio.CancelledError:
+            breaker.record_ignored()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        await asyncio.sleep(delay)
+        attempt += 1
+
+def call_with_retries_sync(send, name: str):
+    """ Blocking version of call_with_retries for the sync client. """
+    breaker = get_breaker(name)
+    attempt = 1
+    while True:
+        breaker.before_request()
+        try:
+            result = send()
+        except OpenAIError as e:
+            delay = _handle_error(breaker, e, attempt, None)
+        else:
+            breaker.record_success()
+            return result
+        time.sleep(delay)
+        attempt += 1
@@ -0,0 +1,167 @@
+""" Optional near-duplicate lookup in front of the exact prompt and image caches.
+
+Prompts are embedded with a hashing vectorizer (words plus character trigrams, hashed into
+a fixed number of signed buckets and L2 normalized), so "margherita pizza, wood-fired" and
+"wood fired margherita pizza" get the same vector without any model to download.  Each kind
+of lookup keeps a brute-force NumPy index of the prompts it has seen; a lookup takes the most
+similar one and, if the cosine similarity reaches the threshold, resolves it through the
+exact cache.  The index only holds prompts, so what is served and for how long is still up
+to the exact caches.
+
+Hits and misses are counted in utils.metrics as semantic_cache_hits.<kind> and
+semantic_cache_misses.<kind>.
+"""
+import os
+import re
+import zlib
+import logging
+import threading
+import numpy as np
+from utils.metrics import metrics, increment_counter
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Minimum cosine similarity for two prompts to count as the same
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "2048"))
+# Prompts kept per kind of lookup; the oldest are replaced first
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+STOP_WORDS = {"a", "an", "the", "and", "with", "of", "on", "in", "for", "to", "at", "my", "our", "some"}
+# Character trigrams weigh less than whole words; they mostly catch typos and compounds
+TRIGRAM_WEIGHT = 0.5
+
+def get_words(prompt: str) -> list:
+    """ Lowercased words without stop words, with simple plurals folded ("tacos" -> "taco"). """
+    words = []
+    for word in re.findall(r"[a-z0-9]+", prompt.lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+def embed_prompt(prompt: str, dim: int = SEMANTIC_CACHE_DIM):
+    """ The L2 normalized hashing vector of the prompt, or None if it has no words. """
+    features = []
+    weights = []
+    for word in get_words(prompt):
+        features.append(f"w:{word}")
+        weights.append(1.0)
+        padded = f"<{word}>"
+        for start in range(len(padded) - 2):
+            features.append(f"c:{padded[start:start + 3]}")
+            weights.append(TRIGRAM_WEIGHT)
+    if not features:
+        return None
+    hashes = np.array([zlib.crc32(feature.encode("utf-8")) for feature in features], dtype=np.uint64)
+    # The low bits pick the bucket and the top bit the sign, so collisions tend to cancel out
+    signs = np.where(hashes >> np.uint64(31) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+    vector = np.zeros(dim, dtype=np.float32)
+    np.add.at(vector, (hashes % np.uint64(dim)).astype(np.int64), signs * np.array(weights, dtype=np.float32))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+class SemanticIndex:
+    """ Thread-safe brute-force cosine index over a fixed number of prompts, replacing the
+    oldest prompt once it is full. """
+    def __init__(self, dim: int, max_entries: int):
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.prompts = [None] * max_entries
+        self._rows = {}
+        self._next_row = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt: str, vector: np.ndarray):
+        with self._lock:
+            if prompt in self._rows:
+                return
+            row = self._next_row
+            if self.prompts[row] is not None:
+                del self._rows[self.prompts[row]]
+            self.vectors[row] = vector
+            self.prompts[row] = prompt
+            self._rows[prompt] = row
+            self._next_row = (row + 1) % len(self.prompts)
+            self._count = min(self._count + 1, len(self.prompts))
+
+    def search(self, vector: np.ndarray) -> tuple:
+        """ The most similar prompt and its cosine similarity, or (None, 0.0) if empty. """
+        with self._lock:
+            if not self._count:
+                return None, 0.0
+            scores = self.vectors[:self._count] @ vector
+            row = int(np.argmax(scores))
+            return self.prompts[row], float(scores[row])
+
+    def __len__(self):
+        return self._count
+
+class SemanticCache:
+    """ One SemanticIndex per kind of lookup (and variant, such as the image size). """
+    def __init__(self, threshold: float, dim: int, max_entries: int):
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def find(self, kind: str, prompt: str, resolve, variant: str = None):
+        """ Resolve the most similar known prompt with resolve(similar_prompt) if it is
+        similar enough.  Returns the resolved value, or None on a miss. """
+        vector = embed_prompt(prompt, self.dim)
+        index = self._indexes.get((kind, variant))
+        value = None
+        if vector is not None and index is not None:
+            similar_prompt, similarity = index.search(vector)
+            if similar_prompt is not None and similarity >= self.threshold:
+                value = resolve(similar_prompt)
+                if value is not None:
+                    logger.debug(f"Semantic cache hit for {kind} ({similarity:.3f}): {prompt!r} ~ {similar_prompt!r}")
+        increment_counter(f"semantic_cache_{'hits' if value is not None else 'misses'}.{kind}")
+        return value
+
+    def add(self, kind: str, prompt: str, variant: str = None):
+        """ Make the prompt findable by later lookups of the same kind and variant. """
+        vector = embed_prompt(prompt, self.dim)
+        if vector is None:
+            return
+        with self._lock:
+            index = self._indexes.get((kind, variant))
+            if index is None:
+                index = self._indexes[(kind, variant)] = SemanticIndex(self.dim, self.max_entries)
+        index.add(prompt, vector)
+
+# Shared by every session in the process
+semantic_cache = SemanticCache(
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_DIM, SEMANTIC_CACHE_MAX_ENTRIES
+) if SEMANTIC_CACHE_ENABLED else None
+
+def find_similar(kind: str, prompt: str, resolve, variant: str = None):
+    """ Look up a near-duplicate prompt of the same kind.  Returns None if disabled. """
+    if semantic_cache is None or not isinstance(prompt, str) or not prompt:
+        return None
+    return semantic_cache.find(kind, prompt, resolve, variant)
+
+def remember_prompt(kind: str, prompt: str, variant: str = None):
+    """ Index a prompt whose result was just cached.  Does nothing if disabled. """
+    if semantic_cache is not None and isinstance(prompt, str) and prompt:
+        semantic_cache.add(kind, prompt, variant)
+
+def get_hit_rates() -> dict:
+    """ Hits, lookups and hit rate per kind of lookup, from the metrics counters. """
+    counters = metrics.counters()
+    hit_rates = {}
+    for counter, value in counters.items():
+        if counter.startswith("semantic_cache_hits."):
+            hit_rates.setdefault(counter.split(".", 1)[1], {"hits": 0, "misses": 0})["hits"] = value
+        elif counter.startswith("semantic_cache_misses."):
+            hit_rates.setdefault(counter.split(".", 1)[1], {"hits": 0, "misses": 0})["misses"] = value
+    for stats in hit_rates.values():
+        stats["lookups"] = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+    return hit_rates
@@ -0,0 +1,49 @@
+""" Helper utils for rendering streamed model output """
+import io
+import time
+
+# Push the text to the page at most every 50ms, or sooner once this many characters are pending
+FLUSH_INTERVAL = 0.05
+FLUSH_PENDING_CHARS = 500
+
+class StreamRenderer:
+    """ Accumulates streamed text and renders it to a Streamlit placeholder in batches,
+    rather than rebuilding the string and pushing markdown on every chunk. """
+    def __init__(
+        self, placeholder, cursor: str = "▌",
+        flush_interval: float = FLUSH_INTERVAL, flush_pending_chars: int = FLUSH_PENDING_CHARS
+    ):
+        self.placeholder = placeholder
+        self.cursor = cursor
+        self.flush_interval = flush_interval
+        self.flush_pending_chars = flush_pending_chars
+        self._buffer = io.StringIO()
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, delta: str):
+        """ Add a streamed delta.  Empty and None deltas (e.g. role-only chunks) are ignored. """
+        if not delta:
+            return
+        self._buffer.write(delta)
+        self._pending_chars += len(delta)
+        if (
+            self._pending_chars >= self.flush_pending_chars
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """ Render the accumulated text, with the cursor unless this is the final render. """
+        self.placeholder.markdown(self.text if final else self.text + self.cursor)
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> str:
+        """ Render the final text and return it. """
+        self.flush(final=True)
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return self._buffer.getvalue()
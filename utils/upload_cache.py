@@ -0,0 +1,57 @@
+""" Cache of processed uploads, so each distinct upload is only converted once """
+import os
+import hashlib
+import asyncio
+import logging
+import streamlit as st
+from utils.cache_utils import LRUCache
+from utils.artifact_store import ArtifactHandle
+from utils.heic_utils import is_heic, prepare_heic_image
+from utils.upload_utils import prepare_vision_image
+from utils.metrics import span
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+UPLOAD_CACHE_MEMORY_BYTES = int(os.getenv("UPLOAD_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+
+# Handles of the prepared uploads in the artifact store, shared by every session and keyed
+# by the sha256 digest of the original file
+upload_cache = LRUCache(max_bytes=UPLOAD_CACHE_MEMORY_BYTES, sizeof=lambda handle: handle.nbytes)
+
+async def process_upload(uploaded_file) -> ArtifactHandle:
+    """ Prepare the uploaded file for the vision model exactly once per distinct upload.
+    Returns a handle to the prepared bytes in the artifact store, owned by the session so
+    they count against its memory budget.  Reruns of the same upload are recognized by the
+    uploader's file id and return the handle already in the session state; identical files
+    uploaded again (in any session) are recognized by their digest. """
+    if (
+        st.session_state.get("user_image_file_id") == uploaded_file.file_id
+        and st.session_state.get("user_image")
+    ):
+        return st.session_state.user_image
+    digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    handle = upload_cache.get(digest)
+    image_bytes = handle.data if handle else None
+    if image_bytes is None:
+        logger.debug(f"Processing upload {uploaded_file.name} ({digest})")
+        with span("upload_encode", heic=is_heic(uploaded_file.name)):
+            if is_heic(uploaded_file.name):
+                image_bytes = await prepare_heic_image(uploaded_file)
+            else:
+                image_bytes = await asyncio.to_thread(prepare_vision_image, uploaded_file)
+        upload_cache.set(digest, ArtifactHandle.from_bytes(image_bytes, shared=True))
+    st.session_state.user_image_file_id = uploaded_file.file_id
+    return ArtifactHandle.from_bytes(image_bytes)
+
+def get_user_image_bytes():
+    """ The prepared bytes of the session's upload, or None if there is none.  Warns the user
+    if the upload has expired from the artifact store. """
+    user_image = st.session_state.get("user_image")
+    if user_image is None:
+        return None
+    image_bytes = user_image.data
+    if image_bytes is None:
+        logger.warning(f"Upload {user_image.digest} expired from the artifact store")
+        st.warning("Your photo has expired, so the image will be created from your description alone.")
+    return image_bytes
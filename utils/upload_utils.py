@@ -0,0 +1,57 @@
+""" Helper utils for preparing uploaded images for the vision model """
+import io
+import os
+import base64
+import logging
+from PIL import Image, ImageOps
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The vision model scales images to fit in a 2048 x 2048 square and then so that the
+# shortest side is 768px, so anything larger is just extra upload and tokens
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "2048"))
+VISION_SHORT_SIDE = int(os.getenv("VISION_SHORT_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
+# EXIF orientations that swap the width and height of the image
+ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+def get_vision_size(width: int, height: int):
+    """ Get the size the vision model would scale an image of the given size to.
+    Images are never scaled up. """
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height), VISION_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def prepare_vision_image(image_file) -> bytes:
+    """ Downscale the uploaded image to the vision model's effective resolution,
+    drop its EXIF data and recompress it as a JPEG.  Returns the JPEG bytes. """
+    image = Image.open(image_file)
+    original_size = image.size
+    target_size = get_vision_size(*original_size)
+    # JPEGs can be decoded at a reduced scale, which is much faster than a full decode
+    image.draft("RGB", target_size)
+    # Apply the EXIF orientation before the metadata is dropped
+    if image.getexif().get(ORIENTATION_TAG, 1) in ROTATED_ORIENTATIONS:
+        target_size = target_size[::-1]
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != target_size:
+        # Shrink by a whole factor first (cheap box filter), then resample to the exact size
+        reduce_factor = min(image.width // target_size[0], image.height // target_size[1])
+        if reduce_factor >= 2:
+            image = image.reduce(reduce_factor)
+        image = image.resize(target_size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    image_bytes = buffer.getvalue()
+    logger.debug(f"Prepared vision image: {original_size} -> {image.size}, {len(image_bytes)} bytes")
+    return image_bytes
+
+def build_image_data_url(image, mime_type: str = "image/jpeg") -> str:
+    """ Build the data URL for the image when the request is sent.  Accepts the raw
+    image bytes or an already base64-encoded str. """
+    encoded_image = image if isinstance(image, str) else base64.b64encode(image).decode("ascii")
+    return f"data:{mime_type};base64,{encoded_image}"